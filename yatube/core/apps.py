@@ -1,6 +1,28 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class CoreConfig(AppConfig):
     name = 'core'
     verbose_name = 'Ядро'
+
+    def ready(self):
+        from .sqlite import apply_pragmas
+        connection_created.connect(
+            apply_pragmas, dispatch_uid='core.sqlite.apply_pragmas'
+        )
+        from .auth import forget_user
+        post_save.connect(
+            forget_user, sender=get_user_model(),
+            dispatch_uid='core.auth.forget_user.save'
+        )
+        post_delete.connect(
+            forget_user, sender=get_user_model(),
+            dispatch_uid='core.auth.forget_user.delete'
+        )
+        if settings.TEMPLATE_CACHE:
+            from .template_backends import warm_up
+            warm_up()
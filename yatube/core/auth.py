@@ -0,0 +1,46 @@
+"""Пользователь запроса из кэша.
+
+AuthenticationMiddleware на каждый запрос вошедшего пользователя
+достаёт его из auth_user. CachedModelBackend держит снимок
+пользователя в кэше USER_CACHE_TIMEOUT секунд под поколением тега
+user:<id>. Сохранение или удаление пользователя, в том числе смена
+пароля, сдвигает тег сразу и ещё раз после коммита, поэтому старую
+строку, прочитанную конкурентным запросом до коммита, из кэша не
+отдают. Снимок, прочитанный с реплики, которая могла ещё не получить
+изменение, в кэш не кладётся.
+Хэш сессии по-прежнему сверяется с паролем из снимка, поэтому после
+смены пароля старые сессии разлогиниваются.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from .cache import bump_tags_on_commit, get_tag_versions, replica_may_lag
+
+USER_PREFIX = 'auth_user:'
+
+
+def user_tag(user_id):
+    return f'user:{user_id}'
+
+
+def user_key(user_id, version):
+    return f'{USER_PREFIX}{user_id}:{version}'
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        versions = get_tag_versions([user_tag(user_id)])
+        key = user_key(user_id, versions[0])
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            if not replica_may_lag(versions):
+                cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
+
+
+def forget_user(sender, instance, **kwargs):
+    bump_tags_on_commit(user_tag(instance.pk))
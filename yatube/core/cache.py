@@ -0,0 +1,278 @@
+"""Кэш страниц с инвалидацией по тегам.
+
+Каждому тегу (`posts`, `group:<slug>`, `author:<id>`, `post:<id>`)
+в кэше соответствует номер поколения. Ключ сохранённой страницы
+включает поколения всех её тегов, поэтому после bump_tags() старые
+копии перестают находиться сразу, а из кэша уходят по TTL.
+
+Те же поколения дают ETag для условных GET: condition_by_tags отвечает
+304, пока ни один тег страницы не сдвинулся.
+"""
+import hashlib
+import logging
+import math
+import random
+import time
+from datetime import datetime, timezone
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.views.decorators.http import condition
+
+from . import db_router, metrics
+
+logger = logging.getLogger(__name__)
+
+TAG_PREFIX = 'tag:'
+LOCK_PREFIX = 'lock:'
+COALESCE_POLL = 0.05
+
+
+def _new_version():
+    return time.time_ns()
+
+
+def get_tag_versions(tags):
+    """Текущие поколения тегов; отсутствующие заводятся заново."""
+    keys = [TAG_PREFIX + tag for tag in tags]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_version(), None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def bump_tags(*tags):
+    """Делает устаревшими все страницы, помеченные этими тегами."""
+    version = _new_version()
+    cache.set_many({TAG_PREFIX + tag: version for tag in tags}, None)
+
+
+def _bump_after_commit(tags):
+    try:
+        bump_tags(*tags)
+    except Exception:
+        logger.exception('Не удалось сдвинуть теги после коммита')
+
+
+def bump_tags_on_commit(*tags):
+    """bump_tags() для записи, которая, возможно, ещё не закоммичена.
+
+    Внутри транзакции теги сдвигаются сразу и ещё раз после коммита:
+    страница, которую конкурентный запрос успел собрать из старых строк
+    под промежуточным поколением, тоже перестаёт находиться.
+    """
+    bump_tags(*tags)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(partial(_bump_after_commit, tags))
+
+
+def page_tags(get_tags, request, *args, **kwargs):
+    """Теги страницы и их поколения, один раз на запрос."""
+    tagged = getattr(request, '_page_tags', None)
+    if tagged is None:
+        tags = get_tags(request, *args, **kwargs)
+        tagged = request._page_tags = (tags, get_tag_versions(tags))
+    return tagged
+
+
+def page_digest(request, tags, versions, vary_on_csrf=False):
+    """Отпечаток страницы: адрес, пользователь, теги и, если страница
+    выводит CSRF-токен, CSRF-кука."""
+    csrf_cookie = (
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+        if vary_on_csrf else ''
+    )
+    raw = '|'.join(map(str, (
+        request.get_full_path(),
+        request.user.pk,
+        csrf_cookie,
+        *tags,
+        *versions,
+    )))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def page_cache_key(request, view, tags, versions, vary_on_csrf=False):
+    digest = page_digest(request, tags, versions, vary_on_csrf)
+    return f'page:{view.__module__}.{view.__name__}:{digest}'
+
+
+def replica_may_lag(versions):
+    """Данные прочитаны с реплики, которая могла ещё не получить
+    запись, сменившую поколение их тегов.
+
+    Такие данные отдают только текущему запросу, а в кэш под свежим
+    поколением не кладут: иначе копия до записи жила бы весь свой срок.
+    """
+    if not db_router.used_replica():
+        return False
+    lag = settings.REPLICA_PIN_SECONDS * 10 ** 9
+    return max((version or 0 for version in versions), default=0) > (
+        time.time_ns() - lag
+    )
+
+
+def is_cacheable(request, response, versions, vary_on_csrf=False):
+    # Страницу с CSRF-токеном можно отдавать только клиенту с той же
+    # кукой: если ключ от куки не зависит или куки у клиента ещё нет,
+    # токен достался бы чужим запросам.
+    private_csrf_token = request.META.get('CSRF_COOKIE_USED') and (
+        not vary_on_csrf
+        or settings.CSRF_COOKIE_NAME not in request.COOKIES
+    )
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        and not private_csrf_token
+        and not replica_may_lag(versions)
+    )
+
+
+def needs_refresh(expires, delta, now):
+    """Пора ли пересчитать запись, срок которой истекает в expires.
+
+    Вероятностное раннее истечение (XFetch): чем дольше считалась
+    страница (delta) и чем ближе срок, тем вероятнее, что один из
+    запросов возьмётся за пересчёт заранее, а не все сразу по сроку.
+    """
+    beta = settings.PAGE_CACHE_EARLY_BETA
+    return now - delta * beta * math.log(1 - random.random()) >= expires
+
+
+def wait_for(key):
+    """Ждёт, пока страницу посчитает запрос, который держит замок.
+
+    None, если замок сняли, а страница в кэш не попала (например,
+    ответ нельзя было кэшировать), или ожидание затянулось.
+    """
+    lock = LOCK_PREFIX + key
+    deadline = time.monotonic() + settings.PAGE_CACHE_COALESCE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(COALESCE_POLL)
+        found = cache.get_many([key, lock])
+        if key in found or lock not in found:
+            return found.get(key)
+    return None
+
+
+def render(page, request, args, kwargs):
+    """Вызывает вьюху и кладёт ответ в кэш вместе со сроком и временем
+    расчёта."""
+    view, key, versions, timeout, vary_on_csrf = page
+    start = time.monotonic()
+    response = view(request, *args, **kwargs)
+    if is_cacheable(request, response, versions, vary_on_csrf):
+        entry = (response, time.time() + timeout, time.monotonic() - start)
+        cache.set(key, entry, timeout + settings.PAGE_CACHE_STALE_SECONDS)
+    return response
+
+
+def regenerate(page, request, args, kwargs):
+    """Пересчёт под замком или None, если страницу уже считают."""
+    lock = LOCK_PREFIX + page[1]
+    if not cache.add(lock, 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+        return None
+    try:
+        return render(page, request, args, kwargs)
+    finally:
+        cache.delete(lock)
+
+
+def cache_page_by_tags(get_tags, timeout=None, vary_on_csrf=False):
+    """Кэширует GET-ответы вьюхи до смены поколения любого из тегов.
+
+    get_tags получает те же аргументы, что и вьюха, и возвращает
+    список тегов страницы. Страницы вьюх, которые выводят CSRF-токен,
+    кэшируются с vary_on_csrf=True — отдельно для каждой CSRF-куки;
+    остальные делятся между всеми клиентами с тем же пользователем,
+    а ответ с токеном у них в кэш не попадает.
+
+    Запись живёт timeout секунд и ещё PAGE_CACHE_STALE_SECONDS после
+    них. Когда срок подходит (см. needs_refresh) или истёк, страницу
+    пересчитывает один запрос, взявший замок через cache.add(), а
+    остальные в это время получают старую копию. Если копии нет
+    совсем, остальные ждут её до PAGE_CACHE_COALESCE_WAIT секунд, а не
+    считают ту же страницу одновременно. Смена поколения тега даёт
+    новый ключ, так что старая копия после записи не отдаётся.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            tags, versions = page_tags(get_tags, request, *args, **kwargs)
+            key = page_cache_key(
+                request, view, tags, versions, vary_on_csrf
+            )
+            page = (
+                view, key, versions, timeout or settings.PAGE_CACHE_TIMEOUT,
+                vary_on_csrf
+            )
+            entry = cache.get(key)
+            metrics.count_cache(entry is not None)
+            if entry is None:
+                response = regenerate(page, request, args, kwargs)
+                if response is not None:
+                    return response
+                entry = wait_for(key)
+                if entry is None:
+                    return render(page, request, args, kwargs)
+            response, expires, delta = entry
+            if needs_refresh(expires, delta, time.time()):
+                return regenerate(page, request, args, kwargs) or response
+            return response
+        return wrapper
+    return decorator
+
+
+def _versions_modified(versions):
+    """Время последнего сдвига тегов: поколения — это time_ns()."""
+    newest = max(filter(None, versions), default=None)
+    if newest is None:
+        return None
+    return datetime.fromtimestamp(newest / 10 ** 9, tz=timezone.utc)
+
+
+def condition_by_tags(get_tags, get_last_modified, vary_on_csrf=False):
+    """Условные GET по тегам страницы.
+
+    ETag строится из тех же поколений тегов, что и ключ кэша страниц,
+    поэтому меняется при любой записи, включая удаления. Last-Modified
+    — позднее из того, что дал get_last_modified, и времени последнего
+    сдвига тегов страницы, так что его тоже двигают удаления и
+    подписки. Результат get_last_modified запоминается в кэше под
+    ETag, так что запрос к базе делается один раз на поколение.
+    Неизменённая страница получает 304 до вызова вьюхи. vary_on_csrf —
+    как у cache_page_by_tags.
+
+    Last-Modified точен до секунды, поэтому изменение в ту же секунду,
+    что и предыдущее, не было бы видно клиенту с If-Modified-Since.
+    Пока с последнего изменения не прошла секунда, заголовок не
+    отдаётся и проверяется только ETag.
+    """
+    def etag(request, *args, **kwargs):
+        tags, versions = page_tags(get_tags, request, *args, **kwargs)
+        return page_digest(request, tags, versions, vary_on_csrf)
+
+    def last_modified(request, *args, **kwargs):
+        key = 'modified:' + etag(request, *args, **kwargs)
+        cached = cache.get(key)
+        tags, versions = page_tags(get_tags, request, *args, **kwargs)
+        if cached is None:
+            # В кортеже, чтобы запомнить и None у пустой страницы.
+            cached = (get_last_modified(request, *args, **kwargs),)
+            if not replica_may_lag(versions):
+                cache.set(key, cached, settings.PAGE_CACHE_TIMEOUT)
+        moments = [cached[0], _versions_modified(versions)]
+        modified = max(filter(None, moments), default=None)
+        if modified is None or time.time() - modified.timestamp() < 1:
+            return None
+        return modified
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
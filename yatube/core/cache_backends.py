@@ -0,0 +1,296 @@
+"""Кэш в файле SQLite, общий для всех процессов на машине.
+
+LocMemCache у каждого воркера свой: страницы прогреваются по разу на
+процесс, а сдвиг поколения тега в одном воркере не виден остальным.
+SQLiteCache хранит записи в одном файле в режиме WAL, так что читатели
+не ждут писателя, а все воркеры видят одни и те же данные.
+
+Запись помнит время последнего обращения, и при превышении MAX_ENTRIES
+или MAX_SIZE (байт) сначала удаляются просроченные записи, а потом
+давно не читанные. Время обращения обновляется не чаще раза в
+ACCESS_RESOLUTION секунд, чтобы чтения не становились записями.
+incr() выполняется в транзакции BEGIN IMMEDIATE и атомарен между
+процессами.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache_backends.SQLiteCache',
+            'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 100000, 'MAX_SIZE': 256 * 2 ** 20},
+        }
+    }
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS cache_entry (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL,
+        accessed REAL NOT NULL,
+        size INTEGER NOT NULL
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS cache_entry_accessed '
+    'ON cache_entry (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_entry_expires '
+    'ON cache_entry (expires)',
+    # Число записей и их суммарный размер держат триггеры, чтобы
+    # проверка лимитов не считала всю таблицу.
+    """
+    CREATE TABLE IF NOT EXISTS cache_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        entries INTEGER NOT NULL,
+        size INTEGER NOT NULL
+    )
+    """,
+    'INSERT OR IGNORE INTO cache_stats VALUES (0, 0, 0)',
+    """
+    CREATE TRIGGER IF NOT EXISTS cache_entry_insert AFTER INSERT
+    ON cache_entry BEGIN
+        UPDATE cache_stats SET entries = entries + 1,
+                               size = size + new.size;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cache_entry_delete AFTER DELETE
+    ON cache_entry BEGIN
+        UPDATE cache_stats SET entries = entries - 1,
+                               size = size - old.size;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cache_entry_update AFTER UPDATE OF size
+    ON cache_entry BEGIN
+        UPDATE cache_stats SET size = size - old.size + new.size;
+    END
+    """,
+)
+PRAGMAS = (
+    'PRAGMA journal_mode = wal',
+    'PRAGMA synchronous = normal',
+    'PRAGMA busy_timeout = 5000',
+)
+UPSERT_SQL = """
+    INSERT INTO cache_entry (key, value, expires, accessed, size)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET
+        value = excluded.value, expires = excluded.expires,
+        accessed = excluded.accessed, size = excluded.size
+"""
+ACCESS_RESOLUTION = 1.0
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        options = params.get('OPTIONS', {})
+        self.max_size = int(options.get('MAX_SIZE', 0)) or None
+        self._local = threading.local()
+
+    # Соединения
+
+    def _connection(self):
+        """Соединение текущего потока; после fork открывается заново."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(
+                self.path, timeout=5, isolation_level=None,
+                check_same_thread=False
+            )
+            for statement in PRAGMAS:
+                db.execute(statement)
+            with self._transaction(db):
+                for statement in SCHEMA:
+                    db.execute(statement)
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    @contextmanager
+    def _transaction(self, db=None):
+        db = db or self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    # Записи
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _load(self, db, key, now):
+        """Значение записи или None, если её нет или она просрочена."""
+        row = db.execute(
+            'SELECT value, expires, accessed FROM cache_entry WHERE key = ?',
+            (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires, accessed = row
+        if expires is not None and expires <= now:
+            return None
+        if accessed < now - ACCESS_RESOLUTION:
+            db.execute(
+                'UPDATE cache_entry SET accessed = ? WHERE key = ?',
+                (now, key)
+            )
+        return value
+
+    def _store(self, db, key, value, timeout, now):
+        blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        db.execute(UPSERT_SQL, (
+            key, blob, self.get_backend_timeout(timeout), now,
+            len(blob) + len(key)
+        ))
+
+    def _cull(self, db, now):
+        entries, size = db.execute(
+            'SELECT entries, size FROM cache_stats'
+        ).fetchone()
+        if entries <= self._max_entries and (
+            self.max_size is None or size <= self.max_size
+        ):
+            return
+        db.execute('DELETE FROM cache_entry WHERE expires <= ?', (now,))
+        entries, size = db.execute(
+            'SELECT entries, size FROM cache_stats'
+        ).fetchone()
+        while entries > self._max_entries or (
+            self.max_size is not None and size > self.max_size
+        ):
+            # Как и у LocMemCache, за раз уходит доля 1/CULL_FREQUENCY.
+            db.execute(
+                'DELETE FROM cache_entry WHERE key IN (SELECT key FROM '
+                'cache_entry ORDER BY accessed LIMIT ?)',
+                (max(entries // self._cull_frequency, 1),)
+            )
+            entries, size = db.execute(
+                'SELECT entries, size FROM cache_stats'
+            ).fetchone()
+
+    # API кэша Django
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        blob = self._load(self._connection(), key, time.time())
+        return default if blob is None else pickle.loads(blob)
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        now = time.time()
+        db = self._connection()
+        rows = db.execute(
+            'SELECT key, value, expires, accessed FROM cache_entry '
+            f'WHERE key IN ({", ".join("?" * len(keys))})',
+            list(keys)
+        ).fetchall()
+        found = {}
+        stale = []
+        for key, value, expires, accessed in rows:
+            if expires is not None and expires <= now:
+                continue
+            found[keys[key]] = pickle.loads(value)
+            if accessed < now - ACCESS_RESOLUTION:
+                stale.append(key)
+        if stale:
+            db.execute(
+                'UPDATE cache_entry SET accessed = ? WHERE key IN '
+                f'({", ".join("?" * len(stale))})',
+                [now, *stale]
+            )
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._transaction() as db:
+            self._store(db, key, value, timeout, now)
+            self._cull(db, now)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        with self._transaction() as db:
+            for key, value in data.items():
+                self._store(db, self._key(key, version), value, timeout, now)
+            self._cull(db, now)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._transaction() as db:
+            if self._load(db, key, now) is not None:
+                return False
+            self._store(db, key, value, timeout, now)
+            self._cull(db, now)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        with self._transaction() as db:
+            blob = self._load(db, key, now)
+            if blob is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(blob) + delta
+            db.execute(
+                'UPDATE cache_entry SET value = ? WHERE key = ?',
+                (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), key)
+            )
+        return value
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._transaction() as db:
+            if self._load(db, key, time.time()) is None:
+                return False
+            db.execute(
+                'UPDATE cache_entry SET expires = ? WHERE key = ?',
+                (self.get_backend_timeout(timeout), key)
+            )
+        return True
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        row = self._connection().execute(
+            'SELECT expires FROM cache_entry WHERE key = ?', (key,)
+        ).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if not keys:
+            return
+        with self._transaction() as db:
+            db.execute(
+                'DELETE FROM cache_entry WHERE key IN '
+                f'({", ".join("?" * len(keys))})',
+                keys
+            )
+
+    def clear(self):
+        with self._transaction() as db:
+            db.execute('DELETE FROM cache_entry')
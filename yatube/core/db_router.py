@@ -0,0 +1,69 @@
+"""Чтение с реплик с прилипанием к основной базе после записи.
+
+Внутри запроса, который прошёл через ReplicaPinMiddleware, чтения
+уходят на случайную реплику из DATABASE_REPLICAS, записи — на default.
+После первой записи запрос до конца читает с default, а ответ ставит
+куку REPLICA_PIN_COOKIE: ещё REPLICA_PIN_SECONDS секунд все запросы
+этого клиента читают с default, пока реплики догоняют его записи.
+
+Вне запросов (команды, воркеры) всё читается с default.
+select_for_update() Django и так отправляет через db_for_write.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+_state = ContextVar('replica_state', default=None)
+
+
+class RequestState:
+    __slots__ = ('pinned', 'wrote', 'used_replica')
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+        self.used_replica = False
+
+
+def start_request(pinned):
+    state = RequestState(pinned)
+    return state, _state.set(state)
+
+
+def finish_request(token):
+    _state.reset(token)
+
+
+def used_replica():
+    """Читал ли текущий запрос что-нибудь с реплики."""
+    state = _state.get()
+    return state is not None and state.used_replica
+
+
+def pin_to_primary():
+    """Отмечает запись, которую сделают в обход роутера этого запроса,
+    например из потока posts.write_behind."""
+    state = _state.get()
+    if state is not None:
+        state.wrote = True
+        state.pinned = True
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = settings.DATABASE_REPLICAS
+        if state is None or state.pinned or not replicas:
+            return DEFAULT_DB_ALIAS
+        state.used_replica = True
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии default, объекты с них можно связывать.
+        return True
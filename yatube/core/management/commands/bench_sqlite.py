@@ -0,0 +1,188 @@
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.sqlite import pragma_statements
+from posts.models import Comment, Post, User
+
+# Что получает соединение Django без профиля.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'delete',
+    'synchronous': 'full',
+}
+WRITE_SQL = (
+    'INSERT INTO posts_comment (post_id, author_id, text, created) '
+    'VALUES (?, ?, ?, ?)',
+    'UPDATE posts_post SET comments_count = comments_count + 1 '
+    'WHERE id = ?',
+)
+
+
+def _qmark(sql):
+    return re.sub(r'(?<!%)%s', '?', sql).replace('%%', '%')
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает конкурентную пропускную способность SQLite с '
+        'настройками по умолчанию и с профилем SQLITE_PRAGMAS на копии '
+        'текущей базы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+
+    def read_queries(self):
+        """Запросы лент в том виде, в каком их строит ORM."""
+        author_id = Post.objects.values_list(
+            'author_id', flat=True
+        ).order_by('-pk').first()
+        post_id = Post.objects.order_by('-comments_count').values_list(
+            'pk', flat=True
+        ).first()
+        querysets = (
+            Post.objects.for_feed().order_by('-pub_date', '-pk')[:11],
+            Post.objects.for_feed().filter(
+                author_id=author_id
+            ).order_by('-pub_date', '-pk')[:11],
+            Comment.objects.select_related('author').filter(
+                post_id=post_id
+            ),
+        )
+        queries = []
+        for queryset in querysets:
+            sql, params = queryset.query.sql_with_params()
+            queries.append((_qmark(sql), params))
+        return queries
+
+    def copy_database(self, pragmas):
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        source = sqlite3.connect(connection.settings_dict['NAME'])
+        target = sqlite3.connect(path)
+        with target:
+            source.backup(target)
+        source.close()
+        # journal_mode хранится в файле базы, остальное — в соединении.
+        target.execute(f'PRAGMA journal_mode = {pragmas["journal_mode"]}')
+        target.close()
+        return path
+
+    def connect(self, path, pragmas):
+        db = sqlite3.connect(path, isolation_level=None)
+        for statement in pragma_statements(pragmas):
+            db.execute(statement)
+        return db
+
+    def read(self, db, rng, deadline, queries, totals):
+        latencies, errors = [], 0
+        while perf_counter() < deadline:
+            sql, params = rng.choice(queries)
+            start = perf_counter()
+            try:
+                db.execute(sql, params).fetchall()
+            except sqlite3.OperationalError:
+                errors += 1
+                continue
+            latencies.append(perf_counter() - start)
+        with totals['lock']:
+            totals['reads'] += len(latencies)
+            totals['errors'] += errors
+            totals['latencies'].extend(latencies)
+
+    def write(self, db, rng, deadline, post_ids, user_ids, totals):
+        writes, errors = 0, 0
+        while perf_counter() < deadline:
+            post_id = rng.choice(post_ids)
+            try:
+                db.execute('BEGIN IMMEDIATE')
+                db.execute(WRITE_SQL[0], (
+                    post_id, rng.choice(user_ids),
+                    'Комментарий из bench_sqlite', '2026-01-01 00:00:00'
+                ))
+                db.execute(WRITE_SQL[1], (post_id,))
+                db.execute('COMMIT')
+            except sqlite3.OperationalError:
+                errors += 1
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+                continue
+            writes += 1
+        with totals['lock']:
+            totals['writes'] += writes
+            totals['errors'] += errors
+
+    def run_profile(self, pragmas, queries, post_ids, user_ids, options):
+        path = self.copy_database(pragmas)
+        deadline = perf_counter() + options['seconds']
+        totals = {
+            'lock': threading.Lock(),
+            'reads': 0, 'writes': 0, 'errors': 0, 'latencies': [],
+        }
+
+        def worker(seed, is_writer):
+            db = self.connect(path, pragmas)
+            rng = random.Random(seed)
+            if is_writer:
+                self.write(db, rng, deadline, post_ids, user_ids, totals)
+            else:
+                self.read(db, rng, deadline, queries, totals)
+            db.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(n, False))
+            for n in range(options['readers'])
+        ] + [
+            threading.Thread(target=worker, args=(n, True))
+            for n in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        latencies = sorted(totals['latencies'])
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+        seconds = options['seconds']
+        return (
+            totals['reads'] / seconds, totals['writes'] / seconds,
+            p95 * 1000, totals['errors']
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда сравнивает только профили SQLite.')
+        post_ids = list(Post.objects.values_list('pk', flat=True)[:10000])
+        user_ids = list(User.objects.values_list('pk', flat=True)[:10000])
+        if not post_ids:
+            raise CommandError(
+                'База пуста: сначала заполните её seed_benchmark.'
+            )
+        queries = self.read_queries()
+        self.stdout.write(
+            f'{"профиль":<10}{"чтений/с":>12}{"записей/с":>12}'
+            f'{"p95 чтения, мс":>16}{"ошибок":>8}'
+        )
+        for name, pragmas in (
+            ('default', DEFAULT_PRAGMAS),
+            ('tuned', settings.SQLITE_PRAGMAS),
+        ):
+            reads, writes, p95, errors = self.run_profile(
+                pragmas, queries, post_ids, user_ids, options
+            )
+            self.stdout.write(
+                f'{name:<10}{reads:>12.0f}{writes:>12.0f}'
+                f'{p95:>16.2f}{errors:>8}'
+            )
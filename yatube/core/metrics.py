@@ -0,0 +1,198 @@
+"""Метрики запросов в текстовом формате Prometheus.
+
+MetricsMiddleware замеряет каждый запрос и раскладывает замеры по
+имени вьюхи (`posts:index`, `posts:profile`, ...): общее время, число
+и время запросов к базе, время рендера шаблонов, попадания и промахи
+кэша страниц и размер ответа. Гистограммы живут в памяти процесса,
+поэтому у каждого воркера веб-сервера они свои; Prometheus собирает
+их с каждого воркера отдельно.
+
+Модули, которые хотят что-то добавить к замеру текущего запроса,
+зовут add_template_time() или count_cache(): вне запроса они ничего
+не делают.
+"""
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_current = ContextVar('request_stats', default=None)
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+HISTOGRAMS = {
+    'yatube_request_duration_seconds': (
+        'Время обработки запроса', 'TIME_BUCKETS'
+    ),
+    'yatube_db_queries': (
+        'Число запросов к базе за запрос', 'QUERY_BUCKETS'
+    ),
+    'yatube_db_duration_seconds': (
+        'Время запросов к базе за запрос', 'TIME_BUCKETS'
+    ),
+    'yatube_template_render_seconds': (
+        'Время рендера шаблонов за запрос', 'TIME_BUCKETS'
+    ),
+    'yatube_response_size_bytes': (
+        'Размер тела ответа', 'SIZE_BUCKETS'
+    ),
+}
+COUNTERS = {
+    'yatube_responses_total': 'Ответы по кодам статуса',
+    'yatube_page_cache_hits_total': 'Попадания в кэш страниц',
+    'yatube_page_cache_misses_total': 'Промахи кэша страниц',
+}
+
+
+class RequestStats:
+    """Замеры одного запроса."""
+
+    __slots__ = ('db_queries', 'db_time', 'template_time',
+                 'cache_hits', 'cache_misses')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def finish_request(token):
+    _current.reset(token)
+
+
+def add_template_time(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.template_time += seconds
+
+
+def count_cache(hit):
+    stats = _current.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+def db_wrapper(stats, timer):
+    """execute_wrapper, считающий запросы к базе в stats."""
+    def wrapper(execute, sql, params, many, context):
+        start = timer()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            stats.db_queries += 1
+            stats.db_time += timer() - start
+    return wrapper
+
+
+def record(view, status, duration, stats, size):
+    """Добавляет замеры запроса к гистограммам вьюхи."""
+    values = {
+        'yatube_request_duration_seconds': duration,
+        'yatube_db_queries': stats.db_queries,
+        'yatube_db_duration_seconds': stats.db_time,
+        'yatube_template_render_seconds': stats.template_time,
+    }
+    if size is not None:
+        values['yatube_response_size_bytes'] = size
+    counts = {
+        ('yatube_responses_total', view, str(status)): 1,
+        ('yatube_page_cache_hits_total', view, None): stats.cache_hits,
+        ('yatube_page_cache_misses_total', view, None): stats.cache_misses,
+    }
+    with _lock:
+        for name, value in values.items():
+            key = (name, view)
+            histogram = _histograms.get(key)
+            if histogram is None:
+                buckets = getattr(settings, 'METRICS_' + HISTOGRAMS[name][1])
+                histogram = _histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+        for key, value in counts.items():
+            if value:
+                _counters[key] = _counters.get(key, 0) + value
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _escape(value):
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join(
+        f'{name}="{_escape(value)}"' for name, value in labels.items()
+    )
+
+
+def render():
+    """Все метрики процесса в текстовом формате Prometheus."""
+    with _lock:
+        histograms = {
+            key: (histogram.buckets, list(histogram.counts), histogram.sum)
+            for key, histogram in _histograms.items()
+        }
+        counters = dict(_counters)
+    lines = []
+    for name, (help_text, _) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, view), (buckets, counts, total) in sorted(
+            histograms.items()
+        ):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{_labels(view=view, le=bound)} '
+                    f'{cumulative}'
+                )
+            lines.append(f'{name}_sum{_labels(view=view)} {total}')
+            lines.append(f'{name}_count{_labels(view=view)} {cumulative}')
+    for name, help_text in COUNTERS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (metric, view, status), value in sorted(
+            counters.items(), key=lambda item: (item[0][1], item[0][2] or '')
+        ):
+            if metric != name:
+                continue
+            labels = (
+                _labels(view=view, status=status) if status
+                else _labels(view=view)
+            )
+            lines.append(f'{name}{labels} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,100 @@
+import logging
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+
+from . import db_router, metrics
+from .queries import NPlusOneError, QueryInspector
+
+logger = logging.getLogger(__name__)
+
+UNRESOLVED = '<unresolved>'
+
+
+class MetricsMiddleware:
+    """Замеряет запрос и складывает замеры в core.metrics.
+
+    Ставится первым в MIDDLEWARE, чтобы в общее время попало всё.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        stats, token = metrics.start_request()
+        start = perf_counter()
+        try:
+            with ExitStack() as stack:
+                wrapper = metrics.db_wrapper(stats, perf_counter)
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(wrapper)
+                    )
+                response = self.get_response(request)
+        finally:
+            metrics.finish_request(token)
+        duration = perf_counter() - start
+        match = request.resolver_match
+        view = match.view_name if match else UNRESOLVED
+        if view != 'metrics':
+            metrics.record(
+                view, response.status_code, duration, stats,
+                None if response.streaming else len(response.content)
+            )
+        return response
+
+
+class NPlusOneMiddleware:
+    """Сообщает о запросах, повторённых за запрос больше порога.
+
+    Включается NPLUSONE_ENABLED (по умолчанию в DEBUG); при
+    NPLUSONE_RAISE вместо предупреждения в лог падает с ошибкой.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.NPLUSONE_ENABLED:
+            return self.get_response(request)
+        with QueryInspector() as inspector:
+            response = self.get_response(request)
+        if inspector.repeated():
+            message = f'N+1 на {request.path}:\n{inspector.report()}'
+            if settings.NPLUSONE_RAISE:
+                raise NPlusOneError(message)
+            logger.warning(message)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """Держит клиента на основной базе, пока реплики догоняют его
+    записи; см. core.db_router."""
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = (
+            request.method not in self.SAFE_METHODS
+            or settings.REPLICA_PIN_COOKIE in request.COOKIES
+        )
+        state, token = db_router.start_request(pinned)
+        try:
+            response = self.get_response(request)
+        finally:
+            db_router.finish_request(token)
+        if state.wrote:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
@@ -0,0 +1,140 @@
+"""Поиск N+1 запросов.
+
+QueryInspector подключается к execute_wrapper всех соединений и
+сводит каждый SQL к отпечатку: литералы и параметры заменяются на `?`,
+списки IN (...) схлопываются. Если один отпечаток встречается больше
+NPLUSONE_THRESHOLD раз, это почти наверняка запрос в цикле по строкам,
+и для него запоминается стек шаблонов и кода проекта, откуда он пришёл.
+
+В разработке проверку делает NPlusOneMiddleware, в тестах —
+QueryBudgetMixin.
+"""
+import os
+import re
+import sys
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDERS = re.compile(r'%s|\?')
+_IN_LISTS = re.compile(r'\bIN \(\?(?:, ?\?)*\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """SQL без конкретных значений: одинаков для всех строк цикла."""
+    sql = _STRINGS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = _PLACEHOLDERS.sub('?', sql)
+    sql = _IN_LISTS.sub('IN (...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def _is_project_file(filename):
+    return (
+        filename.startswith(settings.BASE_DIR)
+        and 'site-packages' not in filename
+        and filename != __file__
+    )
+
+
+def caller_stack():
+    """Шаблоны и строки кода проекта, из которых пришёл запрос.
+
+    Шаблоны берутся из узлов, которые рендерит render_annotated:
+    у каждого узла Django есть origin и token с номером строки.
+    """
+    templates = []
+    code = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        if frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                line = f'{origin.template_name}:{token.lineno}'
+                if not templates or templates[-1] != line:
+                    templates.append(line)
+        elif _is_project_file(frame.f_code.co_filename):
+            path = os.path.relpath(frame.f_code.co_filename, settings.BASE_DIR)
+            code.append(
+                f'{path}:{frame.f_lineno} in {frame.f_code.co_name}'
+            )
+        frame = frame.f_back
+    return templates[::-1] + code[::-1]
+
+
+class RepeatedQuery:
+    def __init__(self, fingerprint, count, stack):
+        self.fingerprint = fingerprint
+        self.count = count
+        self.stack = stack
+
+    def __str__(self):
+        lines = [f'{self.count} раз: {self.fingerprint}']
+        lines.extend(f'    {line}' for line in self.stack)
+        return '\n'.join(lines)
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+class QueryInspector:
+    """Считает запросы по отпечаткам, пока открыт контекст."""
+
+    def __init__(self, threshold=None):
+        if threshold is None:
+            threshold = settings.NPLUSONE_THRESHOLD
+        self.threshold = threshold
+        self.counts = {}
+        self.stacks = {}
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        key = fingerprint(sql)
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        # Стек дорогой, поэтому снимается один раз на отпечаток —
+        # когда тот впервые превысил порог.
+        if count == self.threshold + 1:
+            self.stacks[key] = caller_stack()
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def repeated(self):
+        """Отпечатки, повторившиеся больше порога, начиная с частых."""
+        return sorted(
+            (
+                RepeatedQuery(key, count, self.stacks.get(key, []))
+                for key, count in self.counts.items()
+                if count > self.threshold
+            ),
+            key=lambda query: -query.count
+        )
+
+    def report(self):
+        return '\n'.join(str(query) for query in self.repeated())
+
+
+class QueryBudgetMixin:
+    """Проверки запросов для TestCase."""
+
+    @contextmanager
+    def assertNoRepeatedQueries(self, threshold=None):
+        with QueryInspector(threshold) as inspector:
+            yield inspector
+        if inspector.repeated():
+            self.fail('Похоже на N+1:\n' + inspector.report())
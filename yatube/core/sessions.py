@@ -0,0 +1,79 @@
+"""Сессии в кэше с ленивой записью в базу.
+
+SESSION_ENGINE = 'core.sessions'. Как и cached_db, хранилище читает
+сессию из кэша и идёт в django_session только при промахе. Изменённая
+сессия всегда пишется в кэш, а в базу — при создании, входе и выходе,
+а в остальных случаях не чаще раза в SESSION_DB_SAVE_INTERVAL секунд:
+когда она туда попала, хранится в кэше рядом с самой сессией. Если
+кэш потеряет сессию, из базы поднимется её копия с тем же входом и
+прочими данными не старше этого интервала.
+
+Сверх того хранилище помнит, какой сессия была загружена, и не
+сохраняет её, если данные не изменились: повторная запись того же
+значения или SESSION_SAVE_EVERY_REQUEST не пишут ни в кэш, ни в базу.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+)
+from django.contrib.sessions.backends import cached_db
+
+# Вход и выход пишутся в базу сразу.
+AUTH_KEYS = (SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY)
+
+
+class SessionStore(cached_db.SessionStore):
+    cache_key_prefix = 'core.sessions'
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._stored = None
+
+    def _saved_key(self, session_key):
+        return f'{self.cache_key_prefix}:saved:{session_key}'
+
+    def _db_copy_is_fresh(self):
+        stored = self._stored or {}
+        if any(self._session.get(key) != stored.get(key) for key in AUTH_KEYS):
+            return False
+        saved_at = self._cache.get(self._saved_key(self.session_key))
+        return (
+            saved_at is not None
+            and time.time() - saved_at < settings.SESSION_DB_SAVE_INTERVAL
+        )
+
+    def load(self):
+        data = super().load()
+        self._stored = dict(data)
+        return data
+
+    def save(self, must_create=False):
+        if (
+            not must_create
+            and self._stored is not None
+            and self._session == self._stored
+        ):
+            return
+        if (
+            not must_create
+            and self.session_key is not None
+            and self._db_copy_is_fresh()
+        ):
+            self._cache.set(
+                self.cache_key, self._session, self.get_expiry_age()
+            )
+        else:
+            super().save(must_create)
+            self._cache.set(
+                self._saved_key(self.session_key), time.time(),
+                self.get_expiry_age()
+            )
+        self._stored = dict(self._get_session())
+
+    def delete(self, session_key=None):
+        super().delete(session_key)
+        session_key = session_key or self.session_key
+        if session_key is not None:
+            self._cache.delete(self._saved_key(session_key))
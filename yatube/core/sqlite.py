@@ -0,0 +1,22 @@
+"""Профиль SQLite для боевой нагрузки.
+
+apply_pragmas() вешается на connection_created и выставляет каждому
+новому соединению с SQLite прагмы из SQLITE_PRAGMAS: WAL, чтобы
+писатель не блокировал читателей, synchronous=NORMAL (в WAL это
+безопасно для целостности базы), mmap, размер кэша страниц,
+busy_timeout и временные таблицы в памяти. Вместе с CONN_MAX_AGE
+прагмы выставляются один раз на соединение, а не на каждый запрос.
+"""
+from django.conf import settings
+
+
+def pragma_statements(pragmas):
+    return [f'PRAGMA {name} = {value}' for name, value in pragmas.items()]
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in pragma_statements(settings.SQLITE_PRAGMAS):
+            cursor.execute(statement)
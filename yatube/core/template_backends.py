@@ -0,0 +1,73 @@
+import logging
+import os
+from time import perf_counter
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.template.backends.django import DjangoTemplates, Template, reraise
+from django.template.utils import get_app_template_dirs
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        start = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.add_template_time(perf_counter() - start)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Шаблоны Django, время рендера которых попадает в core.metrics.
+
+    Замеряется только рендер верхнего уровня: include и extends
+    рендерятся внутри него и второй раз не считаются.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(
+                self.engine.get_template(template_name), self
+            )
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+def project_template_names(backend):
+    """Имена шаблонов из DIRS и из приложений самого проекта."""
+    directories = list(backend.engine.dirs) + [
+        directory for directory in get_app_template_dirs('templates')
+        if directory.startswith(settings.BASE_DIR)
+    ]
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith(('.html', '.txt')):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, directory).replace(
+                        os.sep, '/'
+                    )
+
+
+def warm_up():
+    """Компилирует все шаблоны проекта, чтобы кэширующий загрузчик
+    не разбирал их на первых запросах. Возвращает число шаблонов."""
+    compiled = 0
+    for backend in engines.all():
+        if not isinstance(backend, DjangoTemplates):
+            continue
+        for name in project_template_names(backend):
+            try:
+                backend.get_template(name)
+            except (TemplateDoesNotExist, TemplateSyntaxError):
+                logger.exception('Шаблон %s не разобран при прогреве', name)
+                continue
+            compiled += 1
+    return compiled
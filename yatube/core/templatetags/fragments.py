@@ -0,0 +1,41 @@
+from django import template
+from django.template.loader_tags import BlockNode, ExtendsNode
+
+register = template.Library()
+
+
+class InlineNode(template.Node):
+    """Узлы другого шаблона, вшитые в текущий при компиляции."""
+
+    def __init__(self, template_name, nodelist):
+        self.template_name = template_name
+        self.nodelist = nodelist
+
+    def render(self, context):
+        return self.nodelist.render(context)
+
+
+@register.tag
+def inline(parser, token):
+    """{% inline 'имя шаблона' %} — include, который разбирается один раз.
+
+    В отличие от {% include %}, шаблон подставляется в родителя ещё
+    при компиляции: в цикле нет ни поиска шаблона, ни нового уровня
+    контекста на каждой итерации. Поэтому имя должно быть строкой, а
+    сам шаблон — без extends и block.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2 or bits[1][0] not in '\'"' or bits[1][-1] != bits[1][0]:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает одно имя шаблона в кавычках.'
+        )
+    template_name = bits[1][1:-1]
+    loader = parser.origin.loader
+    engine = loader.engine if loader else template.Engine.get_default()
+    nodelist = engine.get_template(template_name).nodelist
+    if nodelist.get_nodes_by_type((ExtendsNode, BlockNode)):
+        raise template.TemplateSyntaxError(
+            f'{template_name} с extends или block нельзя вшить через '
+            f'{bits[0]}.'
+        )
+    return InlineNode(template_name, nodelist)
@@ -0,0 +1,44 @@
+"""Запуск тестов с отдельным кэшем.
+
+Кэш по умолчанию — общий файл SQLite рядом с проектом (см.
+core.cache_backends), и тесты с их cache.clear() стирали бы страницы и
+сессии живого сайта. На время тестов кэш переезжает во временный
+каталог, который потом удаляется: у manage.py test это делает
+TestRunner, у pytest — фикстура в tests/conftest.py.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+@contextmanager
+def temporary_caches():
+    """Все кэши из CACHES — в файлах временного каталога."""
+    directory = tempfile.mkdtemp(prefix='yatube-test-cache-')
+    caches = {
+        alias: dict(config, LOCATION=os.path.join(
+            directory, f'{alias}.sqlite3'
+        ))
+        for alias, config in settings.CACHES.items()
+    }
+    try:
+        with override_settings(CACHES=caches):
+            yield directory
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = temporary_caches()
+        self._caches.__enter__()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)
@@ -1,5 +1,11 @@
+from hmac import compare_digest
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 
+from . import metrics
+
 
 def page_not_found(request, exception):
     return render(
@@ -10,3 +16,19 @@ def page_not_found(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+def metrics_view(request):
+    """Метрики процесса для Prometheus; доступны только с METRICS_TOKEN.
+
+    Адрес клиента не проверяется: за обратным прокси все запросы
+    приходят с 127.0.0.1.
+    """
+    token = settings.METRICS_TOKEN
+    if not token or not compare_digest(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'
+    ):
+        raise Http404
+    return HttpResponse(
+        metrics.render(), content_type='text/plain; version=0.0.4'
+    )
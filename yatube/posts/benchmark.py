@@ -0,0 +1,335 @@
+"""Синтетические данные и нагрузочный прогон лент.
+
+seed() строит набор данных заданного масштаба: авторство постов и
+подписки распределены по степенному закону (у немногих авторов
+большинство постов и подписчиков), часть постов с картинками. Строки
+пишутся bulk_create пачками, поэтому сигналы не срабатывают, а
+счётчики, ленты подписок и поисковый индекс досчитываются в конце.
+
+run() гоняет чтения и записи через обработчик Django в том же
+процессе и для каждого сценария считает p50/p95/p99 задержки, запросы
+к базе на запрос и пропускную способность. Записи откатываются, так
+что прогоны на одном наборе данных сравнимы между собой; отложенная
+запись на время прогона выключена, иначе поток-писатель закоммитил бы
+комментарии и подписки мимо отката.
+"""
+import itertools
+import random
+from bisect import bisect
+from datetime import timedelta
+from io import BytesIO
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from faker import Faker
+from PIL import Image
+
+from core import metrics
+
+from . import counters, feed
+from .models import Comment, Follow, Group, Post, User
+from .utils import keep_dates
+
+PASSWORD = 'benchmark'
+TEXT_POOL = 500
+IMAGE_POOL = 20
+
+
+class PowerLaw:
+    """Выбор номера из range(n) с весом 1 / (номер + 1) ** exponent."""
+
+    def __init__(self, n, exponent, rng):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(
+            1 / (rank + 1) ** exponent for rank in range(n)
+        ))
+
+    def __call__(self):
+        return bisect(
+            self.cumulative, self.rng.random() * self.cumulative[-1]
+        )
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _bulk(model, rows, batch_size, report, **options):
+    created = 0
+    for batch in _batches(rows, batch_size):
+        model.objects.bulk_create(batch, **options)
+        created += len(batch)
+        report(f'{model._meta.verbose_name_plural}: {created}')
+    return created
+
+
+def _image_pool(rng, prefix):
+    names = []
+    for n in range(IMAGE_POOL):
+        buffer = BytesIO()
+        color = tuple(rng.randrange(256) for _ in range(3))
+        Image.new('RGB', (1280, 720), color).save(buffer, 'JPEG')
+        names.append(default_storage.save(
+            f'posts/{prefix}_{n}.jpg', ContentFile(buffer.getvalue())
+        ))
+    return names
+
+
+def seed(users=1000, posts=20000, groups=20, follows=20, comments=20000,
+         image_ratio=0.1, days=365, prefix='bench', exponent=1.1,
+         random_seed=0, batch_size=2000, report=lambda message: None):
+    """Заполняет базу синтетическими данными и возвращает их объёмы."""
+    rng = random.Random(random_seed)
+    fake = Faker('ru_RU')
+    fake.seed_instance(random_seed)
+    texts = [fake.paragraph(nb_sentences=4) for _ in range(TEXT_POOL)]
+    now = timezone.now()
+    period = timedelta(days=days).total_seconds()
+
+    def moment():
+        return now - timedelta(seconds=rng.random() * period)
+
+    password = make_password(PASSWORD)
+    first_user = User.objects.filter(
+        username__startswith=prefix
+    ).count()
+    _bulk(User, (
+        User(
+            username=f'{prefix}{n}',
+            first_name=fake.first_name(),
+            last_name=fake.last_name(),
+            password=password,
+            date_joined=now
+        )
+        for n in range(first_user, first_user + users)
+    ), batch_size, report)
+    user_ids = list(User.objects.filter(
+        username__startswith=prefix
+    ).order_by('pk').values_list('pk', flat=True))[first_user:]
+    _bulk(Group, (
+        Group(
+            title=fake.catch_phrase()[:200],
+            slug=f'{prefix}-{first_user}-{n}',
+            description=fake.paragraph()
+        )
+        for n in range(groups)
+    ), batch_size, report)
+    group_ids = [None] + list(Group.objects.filter(
+        slug__startswith=f'{prefix}-{first_user}-'
+    ).values_list('pk', flat=True))
+
+    # Одни и те же «популярные» пользователи и пишут больше всех,
+    # и собирают больше всех подписчиков.
+    popular = PowerLaw(len(user_ids), exponent, rng)
+    images = _image_pool(rng, prefix) if image_ratio and posts else []
+    first_post = Post.objects.order_by('-pk').values_list(
+        'pk', flat=True
+    ).first() or 0
+    pub_date = Post._meta.get_field('pub_date')
+    created = Comment._meta.get_field('created')
+    with keep_dates(pub_date, created):
+        _bulk(Post, (
+            Post(
+                author_id=user_ids[popular()],
+                group_id=rng.choice(group_ids),
+                text=rng.choice(texts),
+                pub_date=moment(),
+                image=(
+                    rng.choice(images) if rng.random() < image_ratio else ''
+                )
+            )
+            for _ in range(posts)
+        ), batch_size, report)
+        last_post = Post.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+        if last_post > first_post:
+            _bulk(Comment, (
+                Comment(
+                    post_id=rng.randint(first_post + 1, last_post),
+                    author_id=rng.choice(user_ids),
+                    text=rng.choice(texts)[:200],
+                    created=moment()
+                )
+                for _ in range(comments)
+            ), batch_size, report)
+
+    def follow_rows():
+        for user_id in user_ids:
+            # Число подписок тоже с тяжёлым хвостом, в среднем follows.
+            wanted = min(
+                int(rng.paretovariate(2) * follows / 2), len(user_ids) - 1
+            )
+            authors = set()
+            for _ in range(wanted * 2):
+                if len(authors) >= wanted:
+                    break
+                author_id = user_ids[popular()]
+                if author_id != user_id:
+                    authors.add(author_id)
+            for author_id in authors:
+                yield Follow(user_id=user_id, author_id=author_id)
+
+    _bulk(Follow, follow_rows(), batch_size, report, ignore_conflicts=True)
+    report('Счётчики')
+    counters.recount_all()
+    report('Ленты подписок')
+    feed.rebuild_all()
+    cache.clear()
+    return {
+        'users': User.objects.count(),
+        'posts': Post.objects.count(),
+        'comments': Comment.objects.count(),
+        'follows': Follow.objects.count(),
+        'groups': Group.objects.count(),
+    }
+
+
+def percentile(values, share):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(int(round(share * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Sample:
+    """Случайные страницы и пользователи для сценариев."""
+
+    def __init__(self, rng, size=1000):
+        self.rng = rng
+        self.usernames = list(User.objects.filter(
+            stats__posts_count__gt=0
+        ).order_by('-stats__posts_count').values_list(
+            'username', flat=True
+        )[:size])
+        self.readers = list(User.objects.filter(
+            stats__following_count__gt=0
+        ).order_by('?').values_list('pk', flat=True)[:size])
+        self.slugs = list(Group.objects.filter(
+            posts_count__gt=0
+        ).values_list('slug', flat=True)[:size])
+        self.post_ids = list(Post.objects.order_by('?').values_list(
+            'pk', flat=True
+        )[:size])
+
+    def pick(self, values):
+        return self.rng.choice(values)
+
+
+def _scenarios(sample):
+    """Имя: (нужен ли вход, запись ли, функция (client) -> ответ)."""
+    return {
+        'index': (False, False, lambda client: client.get(
+            reverse('posts:index')
+        )),
+        'group_posts': (False, False, lambda client: client.get(reverse(
+            'posts:group_list', kwargs={'slug': sample.pick(sample.slugs)}
+        ))),
+        'profile': (False, False, lambda client: client.get(reverse(
+            'posts:profile',
+            kwargs={'username': sample.pick(sample.usernames)}
+        ))),
+        'post_detail': (False, False, lambda client: client.get(reverse(
+            'posts:post_detail',
+            kwargs={'post_id': sample.pick(sample.post_ids)}
+        ))),
+        'follow_index': (True, False, lambda client: client.get(
+            reverse('posts:follow_index')
+        )),
+        'post_create': (True, True, lambda client: client.post(
+            reverse('posts:post_create'), {'text': 'Пост из бенчмарка'}
+        )),
+        'add_comment': (True, True, lambda client: client.post(
+            reverse(
+                'posts:add_comment',
+                kwargs={'post_id': sample.pick(sample.post_ids)}
+            ),
+            {'text': 'Комментарий из бенчмарка'}
+        )),
+        'profile_follow': (True, True, lambda client: client.get(reverse(
+            'posts:profile_follow',
+            kwargs={'username': sample.pick(sample.usernames)}
+        ))),
+    }
+
+
+SCENARIOS = (
+    'index', 'group_posts', 'profile', 'post_detail', 'follow_index',
+    'post_create', 'add_comment', 'profile_follow',
+)
+
+
+def _measure(request, client):
+    stats = metrics.RequestStats()
+    wrapper = metrics.db_wrapper(stats, perf_counter)
+    start = perf_counter()
+    with connections['default'].execute_wrapper(wrapper):
+        response = request(client)
+    return perf_counter() - start, stats.db_queries, response.status_code
+
+
+@override_settings(WRITE_BEHIND_ENABLED=False)
+def run(scenarios=SCENARIOS, requests=200, warmup=20, cold=False,
+        random_seed=0):
+    """Прогоняет сценарии и возвращает сводку по каждому.
+
+    cold=True чистит кэш перед каждым запросом, так что меряется путь
+    до базы, а не кэш страниц.
+    """
+    rng = random.Random(random_seed)
+    sample = Sample(rng)
+    available = _scenarios(sample)
+    readers = [
+        User.objects.get(pk=pk) for pk in sample.readers[:20]
+    ] or list(User.objects.all()[:1])
+    results = {}
+    for name in scenarios:
+        needs_login, writes, request = available[name]
+        client = Client()
+        if needs_login:
+            client.force_login(rng.choice(readers))
+        latencies = []
+        queries = []
+        statuses = {}
+        started = None
+        for n in range(warmup + requests):
+            if n == warmup:
+                started = perf_counter()
+            if cold:
+                cache.clear()
+            if writes:
+                with transaction.atomic():
+                    measured = _measure(request, client)
+                    transaction.set_rollback(True)
+            else:
+                measured = _measure(request, client)
+            if n >= warmup:
+                latency, count, status = measured
+                latencies.append(latency)
+                queries.append(count)
+                statuses[status] = statuses.get(status, 0) + 1
+        elapsed = perf_counter() - started if started else 0
+        results[name] = {
+            'requests': requests,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'queries': sum(queries) / len(queries) if queries else 0,
+            'rps': requests / elapsed if elapsed else 0,
+            'statuses': statuses,
+        }
+    return results
@@ -0,0 +1,91 @@
+"""Теги кэша страниц постов.
+
+Поколения тегов сдвигают сигналы из posts.signals, а вьюхи
+перечисляют теги, от которых зависит их страница. Функции *_modified
+дают Last-Modified тех же страниц одним агрегатом по индексам.
+"""
+from django.db.models import Max
+
+from .models import Group, Post, User
+
+POSTS = 'posts'
+GROUPS = 'groups'
+USERS = 'users'
+
+
+def group_tag(slug):
+    return f'group:{slug}'
+
+
+def author_tag(author_id):
+    return f'author:{author_id}'
+
+
+def post_tag(post_id):
+    return f'post:{post_id}'
+
+
+def post_tags(post, old_group_id=None):
+    """Теги всех страниц, на которых виден пост."""
+    group_slugs = Group.objects.filter(
+        pk__in={post.group_id, old_group_id} - {None}
+    ).values_list('slug', flat=True)
+    return [
+        POSTS, author_tag(post.author_id), post_tag(post.pk),
+        *map(group_tag, group_slugs)
+    ]
+
+
+def index_tags(request):
+    return [POSTS, GROUPS, USERS]
+
+
+def group_posts_tags(request, slug):
+    return [group_tag(slug), USERS]
+
+
+def profile_tags(request, username):
+    author_id = User.objects.filter(
+        username=username
+    ).values_list('pk', flat=True).first()
+    return [author_tag(author_id), GROUPS, USERS]
+
+
+def post_detail_tags(request, post_id):
+    post = Post.objects.filter(pk=post_id).values_list(
+        'author_id', 'group__slug'
+    ).first()
+    if post is None:
+        return [post_tag(post_id)]
+    author_id, group_slug = post
+    return [
+        post_tag(post_id), author_tag(author_id), group_tag(group_slug),
+        USERS
+    ]
+
+
+def index_modified(request):
+    return Post.objects.aggregate(
+        modified=Max('updated_at')
+    )['modified']
+
+
+def group_posts_modified(request, slug):
+    return Post.objects.filter(group__slug=slug).aggregate(
+        modified=Max('updated_at')
+    )['modified']
+
+
+def profile_modified(request, username):
+    # Подписки и удаления видны в Last-Modified через время сдвига
+    # тега author:<id>, см. core.cache.condition_by_tags.
+    return Post.objects.filter(author__username=username).aggregate(
+        modified=Max('updated_at')
+    )['modified']
+
+
+def post_detail_modified(request, post_id):
+    dates = Post.objects.filter(pk=post_id).aggregate(
+        post=Max('updated_at'), comment=Max('comments__created')
+    )
+    return max(filter(None, dates.values()), default=None)
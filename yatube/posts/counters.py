@@ -0,0 +1,70 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются атомарным UPDATE ... SET x = x + 1 из сигналов
+posts.signals, поэтому их поддерживают и вьюхи, и админка. Команда
+recount пересчитывает их целиком, если они разошлись с данными.
+"""
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+def change_user_stats(user_id, **deltas):
+    # Строки может не быть: её уже удалил каскад от удаляемого
+    # пользователя, и пересоздавать её нельзя. Пропавшую у живого
+    # пользователя строку восстановит команда recount.
+    UserStats.objects.filter(user_id=user_id).update(**{
+        field: F(field) + delta for field, delta in deltas.items()
+    })
+
+
+def change_group_posts(group_id, delta):
+    if group_id is not None:
+        Group.objects.filter(pk=group_id).update(
+            posts_count=F('posts_count') + delta
+        )
+
+
+def change_post_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta
+    )
+
+
+def _count(model, field, outer_field):
+    rows = model.objects.filter(**{field: OuterRef(outer_field)}).order_by()
+    return Coalesce(
+        Subquery(rows.values(field).annotate(n=Count('pk')).values('n')),
+        0
+    )
+
+
+def _repair(queryset, field, actual):
+    return queryset.filter(~Q(**{field: actual})).update(**{field: actual})
+
+
+def recount_all():
+    """Чинит все разошедшиеся счётчики и возвращает число исправлений."""
+    UserStats.objects.bulk_create(
+        (
+            UserStats(user_id=user_id)
+            for user_id in User.objects.filter(
+                stats__isnull=True
+            ).values_list('pk', flat=True)
+        ),
+        ignore_conflicts=True
+    )
+    stats = UserStats.objects.all()
+    return sum((
+        _repair(stats, 'posts_count', _count(Post, 'author', 'user')),
+        _repair(stats, 'followers_count', _count(Follow, 'author', 'user')),
+        _repair(stats, 'following_count', _count(Follow, 'user', 'user')),
+        _repair(
+            Group.objects.all(), 'posts_count', _count(Post, 'group', 'pk')
+        ),
+        _repair(
+            Post.objects.all(), 'comments_count',
+            _count(Comment, 'post', 'pk')
+        ),
+    ))
@@ -0,0 +1,157 @@
+"""Материализованная лента подписок.
+
+Пост обычного автора при публикации раскладывается по лентам всех его
+подписчиков (fan-out-on-write), а чтение ленты идёт по таблице
+FeedEntry без сортировки всех постов подписок. Посты авторов, у
+которых не меньше FEED_PULL_AUTHOR_POSTS постов, не раскладываются:
+они подмешиваются в ленту при чтении.
+
+Автор попадает в режим подмешивания навсегда (UserStats.feed_pull):
+его посты, вышедшие в этом режиме, есть не во всех лентах, и если бы
+после удалений он вернулся к раскладке, они пропали бы из лент
+подписчиков. Флаг пересчитывает только rebuild_all.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, Q, Value, When
+
+from . import follow_graph
+from .models import FeedEntry, Follow, Post, UserStats
+
+PULL_AUTHORS_KEY = 'feed:pull_authors'
+# Поля ключа пагинации ленты, см. feed_posts().
+FEED_KEY = ('feed_date', 'feed_post')
+
+
+def pull_author_ids():
+    """Авторы, чьи посты подмешиваются при чтении."""
+    author_ids = cache.get(PULL_AUTHORS_KEY)
+    if author_ids is None:
+        author_ids = frozenset(
+            UserStats.objects.filter(
+                feed_pull=True
+            ).values_list('user_id', flat=True)
+        )
+        cache.set(
+            PULL_AUTHORS_KEY, author_ids,
+            settings.FEED_PULL_AUTHORS_TIMEOUT
+        )
+    return author_ids
+
+
+def is_pull_author(author_id):
+    if author_id in pull_author_ids():
+        return True
+    if UserStats.objects.filter(
+        Q(feed_pull=True)
+        | Q(posts_count__gte=settings.FEED_PULL_AUTHOR_POSTS),
+        user_id=author_id
+    ).update(feed_pull=True):
+        cache.delete(PULL_AUTHORS_KEY)
+        return True
+    return False
+
+
+def _bulk_add(entries):
+    # bulk_create сам превращает генератор в список, поэтому режем
+    # поток записей на пачки, чтобы не держать его в памяти целиком.
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, settings.FEED_BATCH_SIZE))
+        if not batch:
+            break
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Кладёт новый пост в ленты подписчиков автора."""
+    if is_pull_author(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    _bulk_add(
+        FeedEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in follower_ids.iterator()
+    )
+
+
+def backfill(user_id, author_id):
+    """Дописывает в ленту посты автора, на которого подписались."""
+    if author_id in pull_author_ids():
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'pub_date'
+    )
+    _bulk_add(
+        FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        for post_id, pub_date in posts.iterator()
+    )
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты посты автора, от которого отписались."""
+    FeedEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def feed_posts(user):
+    """Посты ленты подписок пользователя.
+
+    Лента листается по ключу FEED_KEY: для разложенных постов это
+    pub_date и post из FeedEntry, так что страница берётся прямо из
+    индекса (user, -pub_date, -post) без сортировки.
+    """
+    pull_ids = pull_author_ids()
+    pulled_ids = [
+        author_id for author_id in follow_graph.following(user.pk)
+        if author_id in pull_ids
+    ]
+    if not pulled_ids:
+        return Post.objects.filter(feed_entries__user=user).annotate(
+            feed_date=F('feed_entries__pub_date'),
+            feed_post=F('feed_entries__post')
+        )
+    return Post.objects.filter(
+        Q(pk__in=FeedEntry.objects.filter(user=user).values('post'))
+        | Q(author_id__in=pulled_ids)
+    ).annotate(feed_date=F('pub_date'), feed_post=F('pk'))
+
+
+@transaction.atomic
+def rebuild_all():
+    """Пересобирает ленты всех пользователей с нуля."""
+    FeedEntry.objects.all().delete()
+    UserStats.objects.update(feed_pull=Case(
+        When(
+            posts_count__gte=settings.FEED_PULL_AUTHOR_POSTS,
+            then=Value(True)
+        ),
+        default=Value(False),
+        output_field=BooleanField()
+    ))
+    cache.delete(PULL_AUTHORS_KEY)
+    author_ids = list(
+        Follow.objects.exclude(
+            author_id__in=pull_author_ids()
+        ).order_by().values_list('author_id', flat=True).distinct()
+    )
+    for author_id in author_ids:
+        follower_ids = list(
+            Follow.objects.filter(
+                author_id=author_id
+            ).values_list('user_id', flat=True)
+        )
+        posts = Post.objects.filter(author_id=author_id).values_list(
+            'pk', 'pub_date'
+        )
+        _bulk_add(
+            FeedEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+            for post_id, pub_date in posts.iterator()
+            for user_id in follower_ids
+        )
+    return FeedEntry.objects.count()
@@ -0,0 +1,131 @@
+"""Граф подписок в кэше.
+
+Для каждого пользователя в кэше лежат два отсортированных массива
+array('l') первичных ключей: на кого он подписан и кто подписан на
+него. Массивы грузятся из Follow при первом обращении, одним запросом
+на всех, кого не нашлось в кэше, и хранятся под поколением тега
+following:<id> или followers:<id>. Подписка и отписка сдвигают эти
+теги, в том числе после коммита своей транзакции, поэтому старый
+массив просто перестаёт читаться, а загрузка, которая обогнала запись,
+не оставляет в кэше устаревших данных. Массив, прочитанный с реплики,
+которая могла ещё не получить свежую подписку, в кэш не кладётся.
+
+Проверка подписки — двоичный поиск по массиву, а общие подписки и
+рекомендации считаются в памяти без запросов к Follow.
+"""
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.cache import get_tag_versions, replica_may_lag
+
+from .models import Follow
+
+FOLLOWING = 'following'
+FOLLOWERS = 'followers'
+# Список: (чей это список, кто в нём) в полях Follow.
+FIELDS = {
+    FOLLOWING: ('user_id', 'author_id'),
+    FOLLOWERS: ('author_id', 'user_id'),
+}
+# Не больше стольких id в одном IN, чтобы не упереться в лимит
+# переменных SQLite.
+LOAD_CHUNK = 500
+
+
+def graph_tag(direction, user_id):
+    return f'{direction}:{user_id}'
+
+
+def follow_tags(user_id, author_id):
+    """Теги списков, которые меняет подписка user_id на author_id."""
+    return [graph_tag(FOLLOWING, user_id), graph_tag(FOLLOWERS, author_id)]
+
+
+def _load(direction, user_ids):
+    owner, member = FIELDS[direction]
+    members = {user_id: [] for user_id in user_ids}
+    for start in range(0, len(user_ids), LOAD_CHUNK):
+        rows = Follow.objects.filter(**{
+            f'{owner}__in': user_ids[start:start + LOAD_CHUNK]
+        }).values_list(owner, member)
+        for owner_id, member_id in rows.iterator():
+            members[owner_id].append(member_id)
+    return {
+        user_id: array('l', sorted(ids)) for user_id, ids in members.items()
+    }
+
+
+def lists(direction, user_ids):
+    """{id: отсортированный array} списков direction пользователей."""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+    versions = get_tag_versions(
+        [graph_tag(direction, user_id) for user_id in user_ids]
+    )
+    versions = dict(zip(user_ids, versions))
+    keys = {
+        user_id: f'graph:{direction}:{user_id}:{version}'
+        for user_id, version in versions.items()
+    }
+    found = cache.get_many(list(keys.values()))
+    result = {
+        user_id: found[key] for user_id, key in keys.items() if key in found
+    }
+    missing = [user_id for user_id in user_ids if user_id not in result]
+    if missing:
+        loaded = _load(direction, missing)
+        cache.set_many(
+            {
+                keys[user_id]: ids for user_id, ids in loaded.items()
+                if not replica_may_lag([versions[user_id]])
+            },
+            settings.FOLLOW_GRAPH_TIMEOUT
+        )
+        result.update(loaded)
+    return result
+
+
+def following(user_id):
+    """Авторы, на которых подписан пользователь."""
+    return lists(FOLLOWING, [user_id])[user_id]
+
+
+def followers(author_id):
+    """Подписчики автора."""
+    return lists(FOLLOWERS, [author_id])[author_id]
+
+
+def contains(ids, value):
+    position = bisect_left(ids, value)
+    return position < len(ids) and ids[position] == value
+
+
+def is_following(user_id, author_id):
+    return contains(following(user_id), author_id)
+
+
+def mutuals(user_id):
+    """Те, с кем пользователь подписан друг на друга, по возрастанию id."""
+    followed = following(user_id)
+    return [pk for pk in followers(user_id) if contains(followed, pk)]
+
+
+def suggestions(user_id, limit=None):
+    """На кого подписаны авторы из подписок пользователя.
+
+    Список пар (id автора, сколько подписок на него подписано), самые
+    популярные сначала; сам пользователь и его подписки пропускаются.
+    """
+    followed = following(user_id)
+    counts = Counter()
+    for ids in lists(FOLLOWING, followed).values():
+        counts.update(ids)
+    for pk in (*followed, user_id):
+        counts.pop(pk, None)
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return ranked[:limit or settings.FOLLOW_SUGGESTIONS]
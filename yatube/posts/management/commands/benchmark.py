@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Гоняет ленты и записи через Django в том же процессе и '
+        'печатает задержки, запросы на запрос и пропускную способность.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'scenarios', nargs='*',
+            metavar='scenario',
+            help='Сценарии: ' + ', '.join(benchmark.SCENARIOS) + '.'
+        )
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Чистить кэш перед каждым запросом.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--json', metavar='PATH',
+            help='Записать сводку в JSON для сравнения релизов.'
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['scenarios']) - set(benchmark.SCENARIOS)
+        if unknown:
+            raise CommandError(
+                'Нет таких сценариев: ' + ', '.join(sorted(unknown))
+            )
+        results = benchmark.run(
+            scenarios=options['scenarios'] or benchmark.SCENARIOS,
+            requests=options['requests'],
+            warmup=options['warmup'],
+            cold=options['cold'],
+            random_seed=options['seed']
+        )
+        self.stdout.write(
+            f'{"сценарий":<16}{"p50, мс":>10}{"p95, мс":>10}'
+            f'{"p99, мс":>10}{"запросов":>10}{"rps":>10}'
+        )
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<16}{result["p50_ms"]:>10.1f}'
+                f'{result["p95_ms"]:>10.1f}{result["p99_ms"]:>10.1f}'
+                f'{result["queries"]:>10.1f}{result["rps"]:>10.0f}'
+            )
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+            self.stdout.write(
+                self.style.SUCCESS(f'Сводка записана в {options["json"]}')
+            )
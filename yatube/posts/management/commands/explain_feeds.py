@@ -0,0 +1,128 @@
+import inspect
+import re
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from posts import feed
+from posts.models import Group, Post, User
+
+# Признаки плана SQLite, в котором запрос читает таблицу целиком или,
+# прежде чем взять страницу через LIMIT, сортирует все подходящие строки.
+FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)$')
+SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+class Command(BaseCommand):
+    help = (
+        'Печатает планы всех запросов, которые делают страницы лент, '
+        'и отмечает полные просмотры таблиц и сортировки без индекса.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--strict', action='store_true',
+            help='Завершиться с ошибкой, если есть полный просмотр.'
+        )
+
+    def pages(self):
+        """Страницы самых больших автора, группы, поста и читателей.
+
+        Ленту подписок стоит смотреть дважды: у читателя только
+        разложенных постов и у подписчика авторов, чьи посты
+        подмешиваются при чтении.
+        """
+        author = User.objects.annotate(n=Count('posts')).order_by(
+            '-n'
+        ).first()
+        readers = User.objects.annotate(n=Count('follower')).order_by('-n')
+        pulled = feed.pull_author_ids()
+        reader = readers.exclude(follower__author_id__in=pulled).first()
+        pull_reader = readers.filter(follower__author_id__in=pulled).first()
+        group = Group.objects.order_by('-posts_count').first()
+        post = Post.objects.order_by('-comments_count').first()
+        if post is None:
+            raise CommandError('В базе нет постов: нечего объяснять.')
+        pages = {
+            'index': (reverse('posts:index'), None),
+            'profile': (
+                reverse('posts:profile', args=(author.username,)), None
+            ),
+            'post_detail': (
+                reverse('posts:post_detail', args=(post.pk,)), None
+            ),
+            'follow_index': (reverse('posts:follow_index'), reader),
+            'search': (
+                reverse('posts:search') + '?' + urlencode(
+                    {'q': post.text.split()[0]}
+                ),
+                None
+            ),
+        }
+        if pull_reader is not None:
+            pages['follow_index (pull)'] = (
+                reverse('posts:follow_index'), pull_reader
+            )
+        if group is not None:
+            pages['group_list'] = (
+                reverse('posts:group_list', args=(group.slug,)), None
+            )
+        return pages
+
+    def capture(self, path, user):
+        """SQL страницы в обход кэша страниц и проверок входа."""
+        request = RequestFactory().get(path)
+        request.user = user or AnonymousUser()
+        match = resolve(request.path)
+        queries = []
+
+        def wrapper(execute, sql, params, many, context):
+            queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(wrapper):
+            inspect.unwrap(match.func)(request, *match.args, **match.kwargs)
+        return queries
+
+    def explain(self, sql, params):
+        prefix = (
+            'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite'
+            else 'EXPLAIN '
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [str(row[-1]) for row in cursor.fetchall()]
+
+    def is_full_scan(self, line, paged, tables):
+        # SCAN подзапроса или CTE читает уже отобранные строки.
+        scan = FULL_SCAN.search(line)
+        return bool(scan and scan.group(1) in tables) or (
+            paged and SORT in line
+        )
+
+    def handle(self, *args, **options):
+        scans = 0
+        tables = set(connection.introspection.table_names())
+        for name, (path, user) in self.pages().items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{name}: {path}'))
+            for sql, params in self.capture(path, user):
+                if not sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                    continue
+                self.stdout.write(f'  {sql}')
+                paged = ' LIMIT ' in sql.upper()
+                for line in self.explain(sql, params):
+                    if self.is_full_scan(line, paged, tables):
+                        scans += 1
+                        self.stdout.write(self.style.WARNING(f'    ! {line}'))
+                    else:
+                        self.stdout.write(f'    {line}')
+        if scans and options['strict']:
+            raise CommandError(f'Полных просмотров и сортировок: {scans}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Полных просмотров и сортировок: {scans}'
+        ))
@@ -0,0 +1,59 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import export
+
+
+class Command(BaseCommand):
+    help = (
+        'Потоково выгружает посты, комментарии, подписки и группы в '
+        'NDJSON или CSV, по файлу на таблицу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'tables', nargs='*', default=list(export.EXPORTS),
+            help='Что выгружать: ' + ', '.join(export.EXPORTS) + '.'
+        )
+        parser.add_argument(
+            '--format', default='ndjson', choices=export.FORMATS
+        )
+        parser.add_argument(
+            '--since',
+            help='Выгрузить только строки, изменённые с этой ISO-даты.'
+        )
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output-dir', default='.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=export.CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        unknown = set(options['tables']) - set(export.EXPORTS)
+        if unknown:
+            raise CommandError(
+                'Неизвестные таблицы: ' + ', '.join(sorted(unknown))
+            )
+        since = None
+        if options['since']:
+            try:
+                since = export.parse_since(options['since'])
+            except ValueError as error:
+                raise CommandError(error)
+        until = export.watermark()
+        os.makedirs(options['output_dir'], exist_ok=True)
+        for name in options['tables']:
+            path = os.path.join(options['output_dir'], export.file_name(
+                name, options['format'], options['gzip']
+            ))
+            with open(path, 'wb') as output:
+                for chunk in export.export(
+                    name, options['format'], since, until,
+                    options['gzip'], options['chunk_size']
+                ):
+                    output.write(chunk)
+            self.stdout.write(f'{name}: {path}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгрузка готова. Следующая: --since {until.isoformat()}'
+        ))
@@ -0,0 +1,94 @@
+import itertools
+import json
+import os
+from time import perf_counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import counters, feed, importer
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует посты, комментарии или подписки из NDJSON или CSV '
+        'пачками bulk_create и продолжает с контрольной точки после сбоя.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('table', choices=list(importer.TABLES))
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=importer.FORMATS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--create-missing', action='store_true',
+            help='Создавать неизвестных пользователей и группы.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки, по умолчанию <path>.checkpoint.'
+        )
+
+    def load_checkpoint(self, path, source, table):
+        if not os.path.exists(path):
+            return 0, 0
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        if (checkpoint['source'], checkpoint['table']) != (source, table):
+            raise CommandError(
+                f'Контрольная точка {path} относится к другому импорту.'
+            )
+        return checkpoint['done'], checkpoint['skipped']
+
+    def save_checkpoint(self, path, source, table, done, skipped):
+        with open(path + '.tmp', 'w') as checkpoint_file:
+            json.dump({
+                'source': source, 'table': table,
+                'done': done, 'skipped': skipped,
+            }, checkpoint_file)
+        os.replace(path + '.tmp', path)
+
+    def handle(self, *args, **options):
+        table = options['table']
+        source = os.path.abspath(options['path'])
+        if not os.path.exists(source):
+            raise CommandError(f'Файл {source} не найден.')
+        checkpoint = options['checkpoint'] or source + '.checkpoint'
+        start, skipped_before = self.load_checkpoint(
+            checkpoint, source, table
+        )
+        if start:
+            self.stdout.write(f'Продолжаю с строки {start}.')
+        rows = itertools.islice(
+            importer.open_rows(source, options['format']), start, None
+        )
+        started = perf_counter()
+
+        def report(done, skipped):
+            self.save_checkpoint(
+                checkpoint, source, table,
+                start + done, skipped_before + skipped
+            )
+            rate = done / (perf_counter() - started)
+            self.stdout.write(
+                f'{table}: {start + done} строк, пропущено '
+                f'{skipped_before + skipped}, {rate:.0f} строк/с'
+            )
+
+        done, skipped = importer.import_rows(
+            table, rows, options['batch_size'], options['create_missing'],
+            report
+        )
+        elapsed = perf_counter() - started
+        self.stdout.write('Пересчёт счётчиков и лент подписок')
+        counters.recount_all()
+        if table != 'comments':
+            feed.rebuild_all()
+        cache.clear()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано строк: {start + done}, пропущено: '
+            f'{skipped_before + skipped}, '
+            f'{done / elapsed if elapsed else 0:.0f} строк/с'
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts import feed
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок всех пользователей с нуля.'
+
+    def handle(self, *args, **options):
+        entries = feed.rebuild_all()
+        self.stdout.write(
+            self.style.SUCCESS(f'Лент пересобрано, записей: {entries}')
+        )
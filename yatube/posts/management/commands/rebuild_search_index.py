@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Заново строит полнотекстовый индекс постов и комментариев.'
+
+    def handle(self, *args, **options):
+        if not search.uses_fts():
+            raise CommandError('Индекс FTS5 есть только на SQLite.')
+        documents = search.rebuild_index()
+        self.stdout.write(
+            self.style.SUCCESS(f'Документов в индексе: {documents}')
+        )
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+
+from posts import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, постами, '
+        'комментариями и подписками для нагрузочных прогонов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее число подписок на пользователя.'
+        )
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument(
+            '--image-ratio', type=float, default=0.1,
+            help='Доля постов с картинкой.'
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько дней разбросаны даты постов.'
+        )
+        parser.add_argument(
+            '--exponent', type=float, default=1.1,
+            help='Показатель степенного закона популярности авторов.'
+        )
+        parser.add_argument(
+            '--prefix', default='bench',
+            help='Префикс имён пользователей и слагов групп.'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        totals = benchmark.seed(
+            users=options['users'],
+            posts=options['posts'],
+            groups=options['groups'],
+            follows=options['follows'],
+            comments=options['comments'],
+            image_ratio=options['image_ratio'],
+            days=options['days'],
+            prefix=options['prefix'],
+            exponent=options['exponent'],
+            random_seed=options['seed'],
+            batch_size=options['batch_size'],
+            report=(
+                (lambda message: self.stdout.write(message))
+                if verbosity > 1 else (lambda message: None)
+            )
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'В базе: ' + ', '.join(
+                f'{name} {count}' for name, count in totals.items()
+            )
+        ))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Разбирает очередь нарезки миниатюр картинок постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Разобрать очередь один раз и выйти.'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='Пауза между проверками пустой очереди, секунд.'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            done = thumbnails.process_pending()
+            if done:
+                self.stdout.write(f'Нарезано миниатюр для постов: {done}')
+            if options['once']:
+                break
+            if not done:
+                time.sleep(options['interval'])
@@ -0,0 +1,47 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:59
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import F
+
+search_index = import_module('posts.migrations.0009_search_index')
+
+# На SQLite AddField и RemoveField пересоздают таблицу постов, а вместе
+# со старой таблицей пропадают триггеры поискового индекса из 0009.
+POST_TRIGGERS = [
+    statement for statement in search_index.CREATE_SQL
+    if 'TRIGGER' in statement and 'ON posts_post' in statement
+]
+restore_post_triggers = search_index.run_on_sqlite([
+    *search_index.DROP_SQL[:3], *POST_TRIGGERS
+])
+
+
+def copy_pub_date(apps, schema_editor):
+    # Старые посты считаются не изменёнными с момента публикации.
+    Post = apps.get_model('posts', 'Post')
+    Post.objects.update(updated_at=F('pub_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_auto_20261018_0546'),
+    ]
+
+    operations = [
+        # При откате выполняется последней, уже после RemoveField.
+        migrations.RunPython(
+            migrations.RunPython.noop, restore_post_triggers
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(copy_pub_date, migrations.RunPython.noop),
+        migrations.RunPython(
+            restore_post_triggers, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pull_authors(apps, schema_editor):
+    # Без пересборки лент режим авторов остаётся таким, каким был.
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.filter(
+        posts_count__gte=settings.FEED_PULL_AUTHOR_POSTS
+    ).update(feed_pull=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='feed_pull',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Посты подмешиваются в ленту'),
+        ),
+        migrations.RunPython(mark_pull_authors, migrations.RunPython.noop),
+    ]
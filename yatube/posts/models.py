@@ -19,6 +19,11 @@ class Group(models.Model):
         'Описание группы',
         help_text='Enter the group description, please.'
     )
+    posts_count = models.IntegerField(
+        'Постов в группе',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         verbose_name_plural = 'Группы'
@@ -27,6 +32,33 @@ class Group(models.Model):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+    # Поля, которые читает карточка поста в лентах.
+    FEED_FIELDS = (
+        'text', 'pub_date', 'image',
+        'author', 'author__username',
+        'author__first_name', 'author__last_name',
+        'group', 'group__slug', 'group__title',
+    )
+
+    def for_feed(self):
+        """Посты для лент: автор и группа одним запросом,
+        варианты картинок вторым."""
+        return self.select_related('author', 'group').only(
+            *self.FEED_FIELDS
+        ).prefetch_related('image_variants')
+
+    def for_detail(self):
+        """Пост для отдельной страницы вместе с комментариями."""
+        return self.select_related('author__stats', 'group').prefetch_related(
+            models.Prefetch(
+                'comments',
+                queryset=Comment.objects.select_related('author')
+            ),
+            'image_variants'
+        )
+
+
 class Post(models.Model):
     text = models.TextField(
         'Текст поста',
@@ -37,6 +69,11 @@ class Post(models.Model):
         auto_now_add=True,
         help_text='Default value: now'
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+        db_index=True
+    )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -57,11 +94,32 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    comments_count = models.IntegerField(
+        'Комментариев',
+        default=0,
+        editable=False
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Ленты листаются по (-pub_date, -id), см. posts.utils.
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'), name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=('group', '-pub_date', '-id'),
+                name='post_group_pub_date_idx'
+            ),
+        )
 
     def __str__(self):
         return self.text[:15]
@@ -94,6 +152,11 @@ class Comment(models.Model):
         ordering = ('-created',)
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = (
+            models.Index(
+                fields=('post', '-created'), name='comment_post_created_idx'
+            ),
+        )
 
     def __str__(self):
         return self.text
@@ -115,4 +178,135 @@ class Follow(models.Model):
 
     class Meta:
         verbose_name = 'Подписки'
+        # Индекс (user, author) даёт unique_together; обратный нужен
+        # выборкам подписчиков автора.
         unique_together = ('user', 'author',)
+        indexes = (
+            models.Index(
+                fields=('author', 'user'), name='follow_author_user_idx'
+            ),
+        )
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.IntegerField(
+        'Постов',
+        default=0,
+        db_index=True
+    )
+    followers_count = models.IntegerField('Подписчиков', default=0)
+    following_count = models.IntegerField('Подписок', default=0)
+    # Выставляется в posts.feed и сбрасывается только rebuild_feeds.
+    feed_pull = models.BooleanField(
+        'Посты подмешиваются в ленту',
+        default=False,
+        editable=False
+    )
+
+    class Meta:
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
+
+    def __str__(self):
+        return str(self.user)
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Читатель'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField('Дата публикации поста')
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        unique_together = ('user', 'post',)
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-post'),
+                name='feed_user_pub_date_idx'
+            ),
+        )
+
+
+class ThumbnailJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'В работе'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='thumbnail_job',
+        verbose_name='Пост'
+    )
+    status = models.CharField(
+        'Состояние',
+        max_length=10,
+        choices=STATUSES,
+        default=PENDING,
+        db_index=True
+    )
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    error = models.TextField('Последняя ошибка', blank=True)
+    updated = models.DateTimeField('Обновлено', auto_now=True)
+
+    class Meta:
+        ordering = ('updated',)
+        verbose_name = 'Нарезка миниатюр'
+        verbose_name_plural = 'Очередь миниатюр'
+
+    def __str__(self):
+        return f'{self.post_id}: {self.status}'
+
+
+class PostImageVariant(models.Model):
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='image_variants',
+        verbose_name='Пост'
+    )
+    image = models.ImageField('Файл', upload_to='posts/variants/')
+    format = models.CharField('Формат', max_length=10)
+    width = models.PositiveIntegerField('Ширина')
+    height = models.PositiveIntegerField('Высота')
+    size = models.PositiveIntegerField('Размер, байт')
+    color = models.CharField(
+        'Основной цвет',
+        max_length=7,
+        help_text='Цвет заглушки, пока картинка грузится'
+    )
+
+    class Meta:
+        ordering = ('format', 'width')
+        verbose_name = 'Вариант картинки'
+        verbose_name_plural = 'Варианты картинок'
+        unique_together = ('post', 'format', 'width',)
+
+    def __str__(self):
+        return f'{self.post_id}: {self.format} {self.width}w'
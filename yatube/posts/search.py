@@ -0,0 +1,124 @@
+"""Полнотекстовый поиск по постам и комментариям.
+
+На SQLite поиск идёт по виртуальной таблице FTS5 posts_search, которую
+триггеры из миграции 0009 держат в согласии с Post.text и Comment.text.
+Пост находится и по своему тексту, и по тексту комментариев, но
+совпадение в самом посте весит больше. На других СУБД работает
+запасной вариант с icontains.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+# Совпадение в комментарии весит вдвое меньше совпадения в посте;
+# bm25() отрицательна, и чем она меньше, тем выше пост в выдаче.
+# MATERIALIZED не даёт SQLite внести bm25() внутрь агрегата, где
+# она не работает. Процент удвоен: запрос идёт с параметрами.
+RANKED_SQL = """
+    WITH hits AS MATERIALIZED (
+        SELECT post_id,
+               CASE rowid %% 2
+                   WHEN 0 THEN bm25(posts_search)
+                   ELSE bm25(posts_search) / 2
+               END AS score
+        FROM posts_search WHERE posts_search MATCH %s
+    )
+    SELECT post_id, MIN(score) AS best FROM hits
+    GROUP BY post_id ORDER BY best, post_id DESC LIMIT %s OFFSET %s
+"""
+COUNT_SQL = """
+    SELECT COUNT(DISTINCT post_id) FROM posts_search
+    WHERE posts_search MATCH %s
+"""
+MATCH_SQL = 'SELECT post_id FROM posts_search WHERE posts_search MATCH %s'
+
+REBUILD_SQL = (
+    'DELETE FROM posts_search',
+    """
+    INSERT INTO posts_search (rowid, text, post_id)
+    SELECT id * 2, text, id FROM posts_post
+    """,
+    """
+    INSERT INTO posts_search (rowid, text, post_id)
+    SELECT id * 2 + 1, text, post_id FROM posts_comment
+    """,
+    "INSERT INTO posts_search (posts_search) VALUES ('optimize')",
+)
+
+
+def uses_fts():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """Превращает ввод пользователя в безопасный запрос FTS5.
+
+    Каждое слово ищется по префиксу, все слова должны встретиться.
+    """
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class SearchResults:
+    """Ранжированная выдача, которую можно отдать Paginator."""
+
+    def __init__(self, query):
+        self.match = match_expression(query)
+
+    def count(self):
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(COUNT_SQL, [self.match])
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, page):
+        if not self.match:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                RANKED_SQL,
+                [self.match, page.stop - page.start, page.start]
+            )
+            post_ids = [post_id for post_id, _ in cursor.fetchall()]
+        posts = Post.objects.for_feed().in_bulk(post_ids)
+        return [posts[pk] for pk in post_ids if pk in posts]
+
+
+def search_posts(query):
+    if uses_fts():
+        return SearchResults(query)
+    words = query.split()
+    if not words:
+        return Post.objects.none()
+    condition = Q()
+    for word in words:
+        condition &= (
+            Q(text__icontains=word) | Q(comments__text__icontains=word)
+        )
+    return Post.objects.filter(condition).distinct().for_feed()
+
+
+def filter_posts(queryset, query):
+    """Оставляет в queryset только посты, найденные по запросу."""
+    if not uses_fts():
+        return queryset.filter(
+            pk__in=search_posts(query).values('pk')
+        )
+    match = match_expression(query)
+    if not match:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(MATCH_SQL, [match]))
+
+
+@transaction.atomic
+def rebuild_index():
+    with connection.cursor() as cursor:
+        for statement in REBUILD_SQL:
+            cursor.execute(statement)
+        cursor.execute('SELECT COUNT(*) FROM posts_search')
+        return cursor.fetchone()[0]
@@ -0,0 +1,174 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.cache import bump_tags_on_commit
+
+from . import cache_tags, counters, feed, follow_graph, thumbnails
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+# Поля пользователя, которые видны на страницах.
+USER_DISPLAY_FIELDS = ('username', 'first_name', 'last_name')
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_state(sender, instance, **kwargs):
+    (
+        instance._old_author_id,
+        instance._old_group_id,
+        instance._old_image
+    ) = Post.objects.filter(pk=instance.pk).values_list(
+        'author_id', 'group_id', 'image'
+    ).first() or (None, None, None)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_stats(instance.author_id, posts_count=1)
+        counters.change_group_posts(instance.group_id, 1)
+        return
+    if instance._old_author_id != instance.author_id:
+        counters.change_user_stats(instance._old_author_id, posts_count=-1)
+        counters.change_user_stats(instance.author_id, posts_count=1)
+    if instance._old_group_id != instance.group_id:
+        counters.change_group_posts(instance._old_group_id, -1)
+        counters.change_group_posts(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change_user_stats(instance.author_id, posts_count=-1)
+    counters.change_group_posts(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.change_post_comments(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    counters.change_post_comments(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def count_saved_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_stats(instance.author_id, followers_count=1)
+        counters.change_user_stats(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.change_user_stats(instance.author_id, followers_count=-1)
+    counters.change_user_stats(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        feed.fan_out(instance)
+
+
+@receiver(post_save, sender=Post)
+def enqueue_thumbnails(sender, instance, raw=False, **kwargs):
+    if raw or (instance.image.name or '') == (instance._old_image or ''):
+        return
+    # Варианты прежней картинки не должны показываться вместо новой,
+    # пока очередь её не нарежет.
+    if instance._old_image:
+        thumbnails.drop_variants(instance)
+    if instance.image:
+        thumbnails.enqueue(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_feed(sender, instance, **kwargs):
+    feed.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    bump_tags_on_commit(*cache_tags.post_tags(
+        instance, getattr(instance, '_old_group_id', None)
+    ))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    bump_tags_on_commit(cache_tags.post_tag(instance.post_id))
+
+
+@receiver(pre_save, sender=Group)
+def remember_group_slug(sender, instance, **kwargs):
+    instance._old_slug = Group.objects.filter(
+        pk=instance.pk
+    ).values_list('slug', flat=True).first()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_pages(sender, instance, **kwargs):
+    slugs = {instance.slug, getattr(instance, '_old_slug', None)} - {None}
+    bump_tags_on_commit(
+        cache_tags.GROUPS, *map(cache_tags.group_tag, slugs)
+    )
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_pages(sender, instance, **kwargs):
+    # Отписка из write_behind идёт внутри транзакции пачки, и списки
+    # графа подписок нельзя оставить собранными до её коммита.
+    # Профиль подписчика показывает число его подписок.
+    bump_tags_on_commit(
+        cache_tags.author_tag(instance.author_id),
+        cache_tags.author_tag(instance.user_id),
+        *follow_graph.follow_tags(instance.user_id, instance.author_id)
+    )
+
+
+@receiver(pre_save, sender=User)
+def remember_user_names(sender, instance, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login: лишний запрос
+    # здесь не нужен.
+    if instance.pk is None or (
+        update_fields and set(USER_DISPLAY_FIELDS).isdisjoint(update_fields)
+    ):
+        instance._old_names = None
+        return
+    instance._old_names = User.objects.filter(
+        pk=instance.pk
+    ).values_list(*USER_DISPLAY_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def invalidate_renamed_user_pages(sender, instance, created, **kwargs):
+    # Новый пользователь ещё ни на одной странице не виден, а из его
+    # полей на страницах показываются только имена.
+    old_names = getattr(instance, '_old_names', None)
+    if created or old_names is None or old_names == tuple(
+        getattr(instance, field) for field in USER_DISPLAY_FIELDS
+    ):
+        return
+    bump_tags_on_commit(cache_tags.USERS, cache_tags.author_tag(instance.pk))
+
+
+@receiver(post_delete, sender=User)
+def invalidate_user_pages(sender, instance, **kwargs):
+    bump_tags_on_commit(cache_tags.USERS, cache_tags.author_tag(instance.pk))
@@ -0,0 +1,92 @@
+"""Кэш отрисованных карточек постов.
+
+{% postcard post page_obj %}...{% endpostcard %} отдаёт HTML карточки
+из кэша. Ключ включает поколение тега post:<id>, которое сдвигают
+правка поста и готовые миниатюры, а также имя автора и группу, так что
+переименования не требуют отдельной инвалидации. При первой карточке
+страницы тег одним get_many достаёт карточки всех постов page_obj, и
+отрисовываются только промахи. Карточка поста, прочитанного с
+отстающей реплики, в кэш не кладётся.
+"""
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+from core.cache import get_tag_versions, replica_may_lag
+from posts import cache_tags
+
+register = template.Library()
+
+
+def card_key(post, version, variant=''):
+    group = post.group
+    raw = '|'.join(map(str, (
+        version,
+        variant,
+        post.author.username,
+        post.author.get_full_name(),
+        group.slug if group else '',
+        group.title if group else '',
+    )))
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'card:{post.pk}:{digest}'
+
+
+def cached_cards(posts, variant=''):
+    """{pk: (ключ, HTML или None, поколение)} для карточек страницы."""
+    posts = list(posts)
+    versions = get_tag_versions(
+        [cache_tags.post_tag(post.pk) for post in posts]
+    )
+    keys = {
+        post.pk: (card_key(post, version, variant), version)
+        for post, version in zip(posts, versions)
+    }
+    found = cache.get_many([key for key, _ in keys.values()])
+    return {
+        pk: (key, found.get(key), version)
+        for pk, (key, version) in keys.items()
+    }
+
+
+class PostCardNode(template.Node):
+    def __init__(self, post, posts, variant, nodelist):
+        self.post = post
+        self.posts = posts
+        self.variant = variant
+        self.nodelist = nodelist
+
+    def render(self, context):
+        post = self.post.resolve(context)
+        variant = self.variant.resolve(context) if self.variant else ''
+        cards = context.render_context.get(self)
+        if cards is None or post.pk not in cards:
+            cards = cached_cards(self.posts.resolve(context), variant)
+            context.render_context[self] = cards
+        key, html, version = cards[post.pk]
+        if html is None:
+            html = self.nodelist.render(context)
+            if not replica_may_lag([version]):
+                cache.set(key, html, settings.POST_CARD_TIMEOUT)
+        return html
+
+
+@register.tag
+def postcard(parser, token):
+    """{% postcard post page_obj [вариант] %} ... {% endpostcard %}
+
+    Вариант различает карточки одного поста, которые отрисованы
+    по-разному, например в профиле автора без строки об авторе.
+    """
+    bits = token.split_contents()
+    if len(bits) not in (3, 4):
+        raise template.TemplateSyntaxError(
+            f'{bits[0]} принимает пост, список постов страницы и '
+            'необязательный вариант.'
+        )
+    post, posts, *variant = map(parser.compile_filter, bits[1:])
+    nodelist = parser.parse(('endpostcard',))
+    parser.delete_first_token()
+    return PostCardNode(post, posts, variant[0] if variant else None, nodelist)
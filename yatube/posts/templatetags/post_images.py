@@ -0,0 +1,40 @@
+from django import template
+from django.conf import settings
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def ready_thumbnail(image, preset):
+    """Готовая миниатюра или None, пока очередь её не нарезала."""
+    return thumbnails.lookup(image, preset)
+
+
+@register.simple_tag
+def image_sources(post):
+    """srcset для вариантов картинки поста или None, пока их нет.
+
+    Варианты должны быть подгружены через prefetch_related, поэтому
+    тег не ходит ни в базу, ни в хранилище файлов.
+    """
+    variants = post.image_variants.all()
+    if not variants:
+        return None
+    srcsets = {}
+    for variant in variants:
+        srcsets.setdefault(variant.format, []).append(
+            f'{variant.image.url} {variant.width}w'
+        )
+    fallback = max(
+        (variant for variant in variants if variant.format == 'jpeg'),
+        key=lambda variant: variant.width,
+        default=variants[len(variants) - 1]
+    )
+    return {
+        'webp': ', '.join(srcsets.get('webp', ())),
+        'jpeg': ', '.join(srcsets.get('jpeg', ())),
+        'fallback': fallback,
+        'sizes': settings.POST_IMAGE_SIZES,
+    }
@@ -1,10 +1,26 @@
+import gzip
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from core.cache_backends import SQLiteCache
 
-from ..models import Group, Post, Comment, Follow
+from ..models import Group, Post, Comment, Follow, UserStats
 
 User = get_user_model()
 
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
 
 class PostModelTest(TestCase):
     @classmethod
@@ -189,3 +205,326 @@ class FollowModelTest(TestCase):
                         field).verbose_name,
                     expected_value
                 )
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Writer')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='counted',
+            description='Группа со счётчиком'
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other',
+            description='Сюда пост переедет'
+        )
+
+    def refresh(self, *objects):
+        for obj in objects:
+            obj.refresh_from_db()
+
+    def test_counters_follow_creates_edits_and_deletes(self):
+        """Счётчики меняются вместе с постами, комментариями
+        и подписками."""
+        post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост'
+        )
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.refresh(post, self.group, self.author.stats, self.reader.stats)
+        self.assertEqual(self.author.stats.posts_count, 1)
+        self.assertEqual(self.author.stats.followers_count, 1)
+        self.assertEqual(self.reader.stats.following_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        self.assertEqual(post.comments_count, 1)
+
+        post.group = self.other_group
+        post.save()
+        self.refresh(self.group, self.other_group)
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 1)
+
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        post.delete()
+        self.refresh(
+            self.other_group, self.author.stats, self.reader.stats
+        )
+        self.assertEqual(self.other_group.posts_count, 0)
+        self.assertEqual(self.author.stats.posts_count, 0)
+        self.assertEqual(self.author.stats.followers_count, 0)
+        self.assertEqual(self.reader.stats.following_count, 0)
+
+    def test_user_with_posts_and_follows_can_be_deleted(self):
+        """Удаление пользователя не пересоздаёт его статистику."""
+        followed = User.objects.create_user(username='Followed')
+        Post.objects.create(author=self.author, group=self.group, text='1')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=self.author, author=followed)
+        User.objects.get(pk=self.author.pk).delete()
+        connection.check_constraints()
+        self.assertFalse(
+            UserStats.objects.filter(user_id=self.author.pk).exists()
+        )
+        self.refresh(self.reader.stats, followed.stats, self.group)
+        self.assertEqual(self.reader.stats.following_count, 0)
+        self.assertEqual(followed.stats.followers_count, 0)
+        self.assertEqual(self.group.posts_count, 0)
+
+    def test_recount_command_repairs_drift(self):
+        """Команда recount исправляет разошедшиеся счётчики."""
+        Post.objects.create(author=self.author, group=self.group, text='1')
+        UserStats.objects.filter(user=self.author).update(posts_count=42)
+        Group.objects.filter(pk=self.group.pk).update(posts_count=-1)
+        call_command('recount', stdout=StringIO())
+        self.refresh(self.group, self.author.stats)
+        self.assertEqual(self.author.stats.posts_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class BenchmarkTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_seed_and_run(self):
+        """seed_benchmark строит согласованные данные, а benchmark
+        гоняет по ним сценарии, не меняя их."""
+        call_command(
+            'seed_benchmark', users=30, posts=200, comments=100,
+            groups=3, follows=4, image_ratio=0.2, stdout=StringIO()
+        )
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertTrue(Follow.objects.exists())
+        self.assertTrue(Post.objects.exclude(image='').exists())
+        self.assertGreater(
+            Post.objects.dates('pub_date', 'day').count(), 1
+        )
+        out = StringIO()
+        call_command('recount', stdout=out)
+        self.assertIn('Исправлено счётчиков: 0', out.getvalue())
+
+        output = tempfile.NamedTemporaryFile(
+            suffix='.json', dir=TEMP_MEDIA_ROOT, delete=False
+        )
+        follows = Follow.objects.count()
+        # Писатель отложенной записи закоммитил бы мимо отката.
+        with override_settings(WRITE_BEHIND_ENABLED=True), mock.patch(
+            'posts.write_behind.WriteQueue._start',
+            side_effect=AssertionError('запись ушла в очередь')
+        ):
+            call_command(
+                'benchmark', requests=3, warmup=1, json=output.name,
+                stdout=StringIO()
+            )
+        with open(output.name) as results_file:
+            results = json.load(results_file)
+        self.assertEqual(set(results), set(
+            'index group_posts profile post_detail follow_index '
+            'post_create add_comment profile_follow'.split()
+        ))
+        for name, result in results.items():
+            with self.subTest(scenario=name):
+                self.assertEqual(result['requests'], 3)
+                self.assertTrue(
+                    set(result['statuses']) <= {'200', '302'},
+                    result['statuses']
+                )
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertEqual(Follow.objects.count(), follows)
+
+
+class SQLitePragmasTest(TestCase):
+    def test_connection_gets_pragmas(self):
+        """Соединение с базой получает прагмы SQLITE_PRAGMAS."""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(
+                cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout']
+            )
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+
+class ImportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='imported_author')
+        cls.group = Group.objects.create(
+            title='Импорт', slug='import', description='Описание'
+        )
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as output:
+            output.write(content)
+        return path
+
+    def test_import_posts_comments_and_follows(self):
+        """Импорт пачками находит авторов и группы и пересчитывает
+        счётчики."""
+        rows = (
+            {'author': 'imported_author', 'group': 'import',
+             'text': 'Первый', 'pub_date': '2020-01-01T10:00:00'},
+            {'author': 'newcomer', 'text': 'Второй'},
+            {'author': 'nobody', 'group': 'import'},
+        )
+        posts = self.write(
+            'posts.ndjson', '\n'.join(json.dumps(row) for row in rows)
+        )
+        out = StringIO()
+        call_command(
+            'import_yatube', 'posts', posts, '--create-missing',
+            '--batch-size', '2', stdout=out
+        )
+        self.assertIn('строк/с', out.getvalue())
+        self.assertIn('пропущено: 1', out.getvalue())
+        first = Post.objects.get(text='Первый')
+        self.assertEqual(first.group, self.group)
+        self.assertEqual(first.pub_date.year, 2020)
+        self.assertTrue(
+            Post.objects.filter(author__username='newcomer').exists()
+        )
+        self.assertEqual(Group.objects.get(pk=self.group.pk).posts_count, 1)
+
+        follows = self.write('follows.csv', (
+            'user,author\r\n'
+            'newcomer,imported_author\r\n'
+            'newcomer,imported_author\r\n'
+            'newcomer,newcomer\r\n'
+        ))
+        call_command('import_yatube', 'follows', follows, stdout=StringIO())
+        self.assertEqual(Follow.objects.count(), 1)
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).followers_count, 1
+        )
+
+        comments = self.write('comments.ndjson.gz', json.dumps({
+            'post_id': first.pk, 'author': 'newcomer', 'text': 'Ответ'
+        }))
+        call_command(
+            'import_yatube', 'comments', comments, stdout=StringIO()
+        )
+        first.refresh_from_db()
+        self.assertEqual(first.comments_count, 1)
+
+    def test_import_resumes_from_checkpoint(self):
+        """Импорт продолжается со строки из контрольной точки."""
+        path = self.write('posts.csv', (
+            'author,text\r\n'
+            'imported_author,Уже импортирован\r\n'
+            'imported_author,Ещё нет\r\n'
+        ))
+        with open(path + '.checkpoint', 'w') as checkpoint:
+            json.dump({
+                'source': path, 'table': 'posts', 'done': 1, 'skipped': 0
+            }, checkpoint)
+        call_command('import_yatube', 'posts', path, stdout=StringIO())
+        self.assertEqual(
+            list(Post.objects.values_list('text', flat=True)), ['Ещё нет']
+        )
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+
+def _increment(cache, times):
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTest(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'cache.sqlite3')
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.path, {'OPTIONS': options})
+
+    def test_tests_do_not_touch_project_cache(self):
+        """Тесты пишут кэш во временный файл, а не в файл проекта."""
+        location = settings.CACHES['default']['LOCATION']
+        self.assertNotEqual(
+            os.path.dirname(location), str(settings.BASE_DIR)
+        )
+        self.assertTrue(location.startswith(tempfile.gettempdir()))
+
+    def test_cache_api(self):
+        """Бэкенд поддерживает API кэша Django."""
+        cache = self.make_cache()
+        cache.set('key', {'value': 1})
+        self.assertEqual(cache.get('key'), {'value': 1})
+        self.assertFalse(cache.add('key', 'other'))
+        self.assertTrue(cache.add('new', 'value'))
+        cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(
+            cache.get_many(['a', 'b', 'missing']), {'a': 1, 'b': 2}
+        )
+        cache.set('expired', 'value', 0)
+        self.assertIsNone(cache.get('expired'))
+        self.assertFalse(cache.has_key('expired'))
+        self.assertTrue(cache.add('expired', 'again'))
+        self.assertEqual(cache.incr('a', 10), 11)
+        self.assertEqual(cache.decr('a'), 10)
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+        cache.delete_many(['a', 'b'])
+        self.assertFalse(cache.has_key('a'))
+        self.assertTrue(cache.touch('key', None))
+        cache.clear()
+        self.assertIsNone(cache.get('key'))
+
+    def test_processes_share_cache(self):
+        """Запись одного процесса видна другим, incr атомарен."""
+        cache = self.make_cache()
+        cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_increment, args=(cache, 50))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.make_cache().get('counter'), 200)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """Сверх лимитов уходят давно не читанные записи."""
+        cache = self.make_cache(MAX_ENTRIES=4, CULL_FREQUENCY=2)
+        for key in 'abcd':
+            cache.set(key, key)
+        with mock.patch('core.cache_backends.ACCESS_RESOLUTION', -1):
+            cache.get('a')
+        cache.set('e', 'e')
+        self.assertEqual(
+            sorted(cache.get_many('abcde')), ['a', 'd', 'e']
+        )
+        sized = SQLiteCache(self.path + '-sized', {
+            'OPTIONS': {'MAX_SIZE': 10000}
+        })
+        for n in range(10):
+            sized.set(n, 'x' * 2000)
+        self.assertLess(len(sized.get_many(range(10))), 5)
+        self.assertIsNotNone(sized.get(9))
@@ -0,0 +1,162 @@
+import json
+import os
+import statistics
+import tracemalloc
+from time import perf_counter
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from core import metrics
+
+from .. import benchmark
+from ..models import Follow, Group, Post, User
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'perf_baseline.json')
+# UPDATE_PERF_BASELINE=1 перезаписывает базовую линию текущими замерами.
+UPDATE_BASELINE = os.environ.get('UPDATE_PERF_BASELINE') == '1'
+# Во сколько раз замер может превысить базовую линию. Запросы к базе
+# детерминированы и должны совпадать, время зависит от машины.
+DEFAULT_TOLERANCES = {
+    'queries': 1.0,
+    'memory_kb': 1.5,
+    'time_ms': 3.0,
+}
+# Сколько можно добавить сверх допуска в абсолютных единицах, чтобы
+# шум на маленьких значениях не ронял тест.
+DEFAULT_SLACK = {
+    'queries': 0,
+    'memory_kb': 64,
+    'time_ms': 20,
+}
+TIMING_RUNS = 5
+
+
+class PerformanceRegressionTest(TestCase):
+    """Запросы, память и время страниц не хуже базовой линии.
+
+    Страницы меряются с пустым кэшем на наборе seed_benchmark,
+    результат сравнивается с posts/tests/perf_baseline.json.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        benchmark.seed(
+            users=40, posts=400, groups=4, follows=5, comments=200,
+            image_ratio=0, prefix='perf'
+        )
+        author = User.objects.annotate(
+            n=Count('posts')
+        ).order_by('-n', 'username').first()
+        reader = User.objects.annotate(
+            n=Count('follower')
+        ).order_by('-n', 'username').first()
+        post = Post.objects.order_by(
+            '-comments_count', '-pub_date'
+        ).first()
+        group = Group.objects.order_by('-posts_count', 'slug').first()
+        cls.reader = reader
+        cls.pages = {
+            'index': reverse('posts:index'),
+            'group_list': reverse(
+                'posts:group_list', kwargs={'slug': group.slug}
+            ),
+            'profile': reverse(
+                'posts:profile', kwargs={'username': author.username}
+            ),
+            'post_detail': reverse(
+                'posts:post_detail', kwargs={'post_id': post.pk}
+            ),
+            'follow_index': reverse('posts:follow_index'),
+            'search': reverse('posts:search') + '?' + urlencode(
+                {'q': post.text.split()[0]}
+            ),
+        }
+        assert Follow.objects.filter(user=reader).exists()
+
+    def setUp(self):
+        self.clients = {
+            'anonymous': Client(),
+            'reader': Client(),
+        }
+        self.clients['reader'].force_login(self.reader)
+
+    def request(self, name):
+        client = self.clients[
+            'reader' if name == 'follow_index' else 'anonymous'
+        ]
+        cache.clear()
+        return client.get(self.pages[name])
+
+    def measure(self, name):
+        # Прогрев: первые импорты и компиляция шаблонов не в счёт.
+        self.request(name)
+        stats = metrics.RequestStats()
+        with connection.execute_wrapper(
+            metrics.db_wrapper(stats, perf_counter)
+        ):
+            response = self.request(name)
+        self.assertEqual(response.status_code, 200)
+
+        tracemalloc.start()
+        try:
+            self.request(name)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        timings = []
+        for _ in range(TIMING_RUNS):
+            start = perf_counter()
+            self.request(name)
+            timings.append(perf_counter() - start)
+        return {
+            'queries': stats.db_queries,
+            'memory_kb': round(peak / 1024),
+            'time_ms': round(statistics.median(timings) * 1000, 1),
+        }
+
+    def load_baseline(self):
+        if not os.path.exists(BASELINE_PATH):
+            return {'pages': {}}
+        with open(BASELINE_PATH) as baseline_file:
+            return json.load(baseline_file)
+
+    def test_pages_do_not_regress(self):
+        baseline = self.load_baseline()
+        tolerances = {**DEFAULT_TOLERANCES, **baseline.get('tolerances', {})}
+        slack = {**DEFAULT_SLACK, **baseline.get('slack', {})}
+        measured = {name: self.measure(name) for name in self.pages}
+        if UPDATE_BASELINE:
+            with open(BASELINE_PATH, 'w') as baseline_file:
+                json.dump(
+                    {
+                        'tolerances': tolerances,
+                        'slack': slack,
+                        'pages': measured,
+                    },
+                    baseline_file, indent=2, sort_keys=True
+                )
+                baseline_file.write('\n')
+            return
+        for name, values in measured.items():
+            expected = baseline['pages'].get(name)
+            if expected is None:
+                self.fail(
+                    f'Для {name} нет базовой линии: запустите тесты '
+                    'с UPDATE_PERF_BASELINE=1'
+                )
+            for metric, value in values.items():
+                with self.subTest(page=name, metric=metric):
+                    limit = (
+                        expected[metric] * tolerances[metric] + slack[metric]
+                    )
+                    self.assertLessEqual(
+                        value, limit,
+                        f'{name}: {metric} {value} при базовой линии '
+                        f'{expected[metric]} (допуск ×{tolerances[metric]})'
+                    )
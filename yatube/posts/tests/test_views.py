@@ -1,15 +1,50 @@
+import csv
+import gzip
+import json
+import os
 import shutil
 import tempfile
+import threading
+import time
+from concurrent import futures
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.http import HttpResponse
+from django.template import Context, Template, TemplateSyntaxError, engines
+from django.test import (
+    Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
 
+from core import cache as core_cache
+from core import db_router, metrics
+from core.auth import CachedModelBackend, user_key, user_tag
+from core.sessions import SessionStore
+from core.cache import (
+    LOCK_PREFIX, TAG_PREFIX, bump_tags, get_tag_versions, needs_refresh,
+    page_cache_key, page_digest
+)
+from core.queries import QueryBudgetMixin, QueryInspector, fingerprint
+from core.template_backends import warm_up
+
+from .. import cache_tags, follow_graph, thumbnails, views, write_behind
 from ..forms import PostForm
-from ..models import Post, Group, Comment, Follow
+from ..models import (
+    Post, Group, Comment, FeedEntry, Follow, ThumbnailJob, UserStats
+)
+from ..templatetags.post_cards import cached_cards
 
 User = get_user_model()
 
@@ -264,6 +299,50 @@ class ViewsTest(TestCase):
         third_response = self.authorized_author.get(index_page)
         self.assertEqual(third_response.content, first_response.content)
 
+    def test_cached_pages_are_invalidated_by_writes(self):
+        """Страницы берутся из кэша, но сразу обновляются после
+        изменения постов, групп и комментариев."""
+        index_page = reverse('posts:index')
+        group_page = reverse(
+            'posts:group_list',
+            kwargs={'slug': self.group.slug}
+        )
+        detail_page = reverse(
+            'posts:post_detail',
+            kwargs={'post_id': self.single_post.id}
+        )
+        # Первый ответ ставит куку csrftoken и поэтому не кэшируется.
+        for page in (index_page, group_page, detail_page, detail_page):
+            self.authorized_author.get(page)
+        with self.assertNumQueries(1):
+            # Сессия и пользователь берутся из кэша, остаётся поиск
+            # автора для тегов поста.
+            self.authorized_author.get(detail_page)
+        new_post = Post.objects.create(
+            author=self.post_author,
+            group=self.group,
+            text='Пост, который надо увидеть сразу'
+        )
+        for page in (index_page, group_page):
+            with self.subTest(page=page):
+                self.assertContains(
+                    self.authorized_author.get(page), new_post.text
+                )
+        Comment.objects.create(
+            text='Свежий комментарий',
+            post=self.single_post,
+            author=self.post_author
+        )
+        self.assertContains(
+            self.authorized_author.get(detail_page), 'Свежий комментарий'
+        )
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новое название группы'
+        group.save()
+        self.assertContains(
+            self.authorized_author.get(index_page), 'Новое название группы'
+        )
+
     def test_auth_user_follow_another(self):
         """Авторизованный пользователь может подписываться
         на другого пользователя."""
@@ -382,3 +461,1344 @@ class PaginatorViewsTest(TestCase):
             len(response.context['page_obj']),
             self.posts_on_second_page
         )
+
+    def test_index_cursor_pages_follow_each_other(self):
+        """Курсорные ссылки «вперёд» и «назад» ведут на соседние
+        страницы без пропусков и повторов."""
+        first_page = self.client.get(
+            reverse('posts:index')
+        ).context['page_obj']
+        self.assertTrue(first_page.has_next())
+        self.assertFalse(first_page.has_previous())
+        second_page = self.client.get(
+            reverse('posts:index'),
+            {'after': first_page.next_cursor, 'page': 2}
+        ).context['page_obj']
+        self.assertEqual(len(second_page), self.posts_on_second_page)
+        self.assertEqual(second_page.number, 2)
+        self.assertFalse(second_page.has_next())
+        self.assertTrue(second_page.has_previous())
+        self.assertFalse(set(first_page) & set(second_page))
+        back_page = self.client.get(
+            reverse('posts:index'),
+            {'before': second_page.previous_cursor, 'page': 1}
+        ).context['page_obj']
+        self.assertEqual(list(back_page), list(first_page))
+
+    def test_broken_cursor_returns_first_page(self):
+        """Испорченный курсор не ломает страницу."""
+        response = self.client.get(
+            reverse('posts:index'), {'after': 'not-a-cursor'}
+        )
+        self.assertEqual(
+            list(response.context['page_obj']),
+            list(Post.objects.order_by('-pub_date', '-pk')[
+                :settings.POSTS_PER_PAGE
+            ])
+        )
+
+
+class FollowFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.author = User.objects.create_user(username='Writer')
+        cls.old_post = Post.objects.create(
+            text='Пост, написанный до подписки',
+            author=cls.author
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_reader = Client()
+        self.authorized_reader.force_login(self.reader)
+
+    def get_feed(self):
+        response = self.authorized_reader.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_prunes_feed(self):
+        """Подписка дописывает в ленту старые посты автора,
+        отписка убирает их."""
+        self.authorized_reader.get(reverse(
+            'posts:profile_follow',
+            kwargs={'username': self.author.username}
+        ))
+        self.assertEqual(self.get_feed(), [self.old_post])
+        self.authorized_reader.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': self.author.username}
+        ))
+        self.assertEqual(self.get_feed(), [])
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        """Новый пост сразу попадает в ленты подписчиков."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(text='Свежий пост', author=self.author)
+        self.assertTrue(
+            FeedEntry.objects.filter(
+                user=self.reader, post=new_post
+            ).exists()
+        )
+        self.assertEqual(self.get_feed(), [new_post, self.old_post])
+
+    @override_settings(FEED_PULL_AUTHOR_POSTS=2)
+    def test_prolific_author_is_merged_on_read(self):
+        """Посты плодовитого автора не раскладываются по лентам,
+        а подмешиваются при чтении."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(text='Второй пост', author=self.author)
+        self.assertFalse(
+            FeedEntry.objects.filter(post=new_post).exists()
+        )
+        self.assertEqual(self.get_feed(), [new_post, self.old_post])
+
+    @override_settings(FEED_PULL_AUTHOR_POSTS=2)
+    def test_pulled_posts_stay_in_feed_after_deletions(self):
+        """Автор, ушедший под порог после удалений, остаётся в режиме
+        подмешивания до rebuild_feeds."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        pulled_post = Post.objects.create(text='Второй', author=self.author)
+        Post.objects.create(text='Третий', author=self.author).delete()
+        Post.objects.filter(pk=self.old_post.pk).delete()
+        # Список авторов в кэше со временем истекает.
+        cache.clear()
+        self.assertEqual(self.get_feed(), [pulled_post])
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertFalse(UserStats.objects.get(user=self.author).feed_pull)
+        self.assertEqual(self.get_feed(), [pulled_post])
+
+    def test_rebuild_feeds_command_restores_timelines(self):
+        """Команда rebuild_feeds восстанавливает ленты с нуля."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        FeedEntry.objects.all().delete()
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(self.get_feed(), [self.old_post])
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    """Число запросов страницы не зависит от числа постов на ней."""
+
+    # Страница: запросов с пустым кэшем. Один из них — агрегат для
+    # Last-Modified, который потом берётся из кэша; в ленте два —
+    # загрузка графа подписок, который тоже остаётся в кэше.
+    QUERY_BUDGET = {
+        'index': 4,
+        'group_list': 5,
+        'profile': 5,
+        'post_detail': 5,
+        'follow_index': 8,
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='Reader')
+        authors = [
+            User.objects.create_user(username=f'Writer{n}')
+            for n in range(3)
+        ]
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='budget',
+            description='Посты для подсчёта запросов'
+        )
+        cls.author = authors[0]
+        for author in authors:
+            Follow.objects.create(user=cls.reader, author=author)
+            for n in range(settings.POSTS_PER_PAGE):
+                post = Post.objects.create(
+                    author=author, group=cls.group, text=f'Пост {n}'
+                )
+        cls.post = post
+        for author in authors:
+            Comment.objects.create(
+                post=cls.post, author=author, text='Комментарий'
+            )
+
+    def setUp(self):
+        self.authorized_reader = Client()
+        self.authorized_reader.force_login(self.reader)
+
+    def test_pages_fit_query_budget(self):
+        pages = {
+            'index': reverse('posts:index'),
+            'group_list': reverse(
+                'posts:group_list', kwargs={'slug': self.group.slug}
+            ),
+            'profile': reverse(
+                'posts:profile', kwargs={'username': self.author}
+            ),
+            'post_detail': reverse(
+                'posts:post_detail', kwargs={'post_id': self.post.id}
+            ),
+            'follow_index': reverse('posts:follow_index'),
+        }
+        for name, page in pages.items():
+            with self.subTest(page=name):
+                cache.clear()
+                client = (
+                    self.authorized_reader if name == 'follow_index'
+                    else self.client
+                )
+                with self.assertNumQueries(self.QUERY_BUDGET[name]):
+                    with self.assertNoRepeatedQueries():
+                        client.get(page)
+
+    def test_feeds_are_read_by_index(self):
+        """explain_feeds не находит в лентах полных просмотров и
+        сортировок без индекса."""
+        out = StringIO()
+        call_command('explain_feeds', no_color=True, stdout=out)
+        sections = {}
+        for line in out.getvalue().splitlines():
+            if not line.startswith(' '):
+                name = line.split(':')[0]
+            sections.setdefault(name, []).append(line)
+        for name in ('index', 'group_list', 'profile', 'follow_index'):
+            with self.subTest(page=name):
+                self.assertIn(name, sections)
+                flagged = [
+                    line for line in sections[name] if '! ' in line
+                ]
+                self.assertEqual(flagged, [])
+
+    def test_fingerprint_ignores_values(self):
+        """Запросы, отличающиеся только значениями, — один отпечаток."""
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id = 1 AND name = \'a\''),
+            fingerprint('SELECT *  FROM t WHERE id = %s AND name = %s')
+        )
+        self.assertEqual(
+            fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            fingerprint('SELECT * FROM t WHERE id IN (%s)')
+        )
+
+    def test_inspector_points_at_template_loop(self):
+        """Детектор находит запрос в цикле шаблона и показывает,
+        откуда он."""
+        template = Template(
+            '{% for post in posts %}{{ post.author.username }}{% endfor %}'
+        )
+        posts = list(Post.objects.only('text', 'author'))
+        with QueryInspector(threshold=3) as inspector:
+            template.render(Context({'posts': posts}))
+        repeated = inspector.repeated()
+        self.assertEqual(len(repeated), 1)
+        self.assertEqual(repeated[0].count, len(posts))
+        self.assertIn('posts/tests/test_views.py', inspector.report())
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Writer')
+        cls.about_cats = Post.objects.create(
+            author=cls.author, text='Пост про кошек и собак'
+        )
+        cls.about_dogs = Post.objects.create(
+            author=cls.author, text='Пост про собак'
+        )
+        cls.other = Post.objects.create(
+            author=cls.author, text='Совсем другое'
+        )
+        Comment.objects.create(
+            post=cls.other, author=cls.author, text='А где кошки?'
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        return list(response.context['page_obj'])
+
+    def test_search_finds_posts_and_comments(self):
+        """Поиск находит посты по тексту поста и комментариев,
+        совпадение в посте выше."""
+        self.assertEqual(self.search('кош'), [self.about_cats, self.other])
+        self.assertEqual(
+            set(self.search('собак')), {self.about_cats, self.about_dogs}
+        )
+        self.assertEqual(self.search('"; DROP'), [])
+
+    def test_search_with_query_logging(self):
+        """Поиск работает, когда запросы логируются, как при DEBUG."""
+        with CaptureQueriesContext(connection):
+            self.assertEqual(
+                self.search('кош'), [self.about_cats, self.other]
+            )
+
+    def test_search_index_follows_edits_and_deletes(self):
+        """Индекс обновляется при правке и удалении постов."""
+        self.about_dogs.text = 'Теперь про попугаев'
+        self.about_dogs.save()
+        self.assertEqual(self.search('попугаев'), [self.about_dogs])
+        self.about_dogs.delete()
+        self.assertEqual(self.search('попугаев'), [])
+
+    def test_rebuild_search_index_command(self):
+        """Команда rebuild_search_index строит индекс заново."""
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_search')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('другое'), [self.other])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailQueueTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Photographer')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_author = Client()
+        self.authorized_author.force_login(self.author)
+
+    def test_thumbnails_are_cut_by_queue_not_by_page(self):
+        """Страница отдаёт оригинал, пока очередь не нарезала
+        миниатюру, и сама её не режет."""
+        image = SimpleUploadedFile(
+            name='queued.gif',
+            content=(
+                b'\x47\x49\x46\x38\x39\x61\x02\x00'
+                b'\x01\x00\x80\x00\x00\x00\x00\x00'
+                b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+                b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+                b'\x0A\x00\x3B'
+            ),
+            content_type='image/gif'
+        )
+        self.authorized_author.post(
+            reverse('posts:post_create'),
+            data={'text': 'Пост с картинкой', 'image': image}
+        )
+        post = Post.objects.get(text='Пост с картинкой')
+        self.assertEqual(post.thumbnail_job.status, ThumbnailJob.PENDING)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, post.image.url)
+        self.assertIsNone(thumbnails.lookup(post.image, 'card'))
+
+        self.assertEqual(thumbnails.process_pending(), 1)
+        post.thumbnail_job.refresh_from_db()
+        self.assertEqual(post.thumbnail_job.status, ThumbnailJob.DONE)
+        thumbnail = thumbnails.lookup(post.image, 'card')
+        self.assertIsNotNone(thumbnail)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, post.image_variants.first().image.url)
+
+    def test_queue_prepares_responsive_variants(self):
+        """Очередь готовит варианты картинки, а лента отдаёт их
+        через srcset."""
+        post = Post.objects.create(
+            author=self.author,
+            text='Пост с вариантами',
+            image=SimpleUploadedFile(
+                name='wide.png',
+                content=self.make_png(),
+                content_type='image/png'
+            )
+        )
+        thumbnails.process_pending()
+        variants = post.image_variants.all()
+        self.assertEqual(
+            {(variant.format, variant.width) for variant in variants},
+            {
+                (image_format.lower(), width)
+                for image_format in settings.POST_IMAGE_FORMATS
+                for width in settings.POST_IMAGE_WIDTHS
+            }
+        )
+        self.assertTrue(all(variant.size > 0 for variant in variants))
+        self.assertEqual(variants[0].color, '#ff0000')
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'srcset=')
+        self.assertContains(response, variants[0].image.url)
+
+    def test_new_image_drops_old_variants(self):
+        """После замены картинки лента не отдаёт варианты старой."""
+        post = Post.objects.create(
+            author=self.author,
+            text='Пост со сменой картинки',
+            image=SimpleUploadedFile(
+                name='old.png', content=self.make_png(),
+                content_type='image/png'
+            )
+        )
+        thumbnails.process_pending()
+        old_url = post.image_variants.first().image.url
+        post.image = SimpleUploadedFile(
+            name='new.png', content=self.make_png(),
+            content_type='image/png'
+        )
+        post.save()
+        self.assertFalse(post.image_variants.exists())
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, old_url)
+        self.assertContains(response, post.image.url)
+
+    def make_png(self):
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 600), (255, 0, 0)).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+
+@override_settings(METRICS_TOKEN='metrics-token')
+class MetricsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Measured')
+        Post.objects.create(author=cls.author, text='Замеряемый пост')
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+
+    def test_views_are_measured(self):
+        """Запросы раскладываются по именам вьюх вместе с базой,
+        шаблонами и кэшем."""
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:index'))
+        self.client.get(
+            reverse('posts:profile', kwargs={'username': 'Measured'})
+        )
+        response = self.client.get(
+            reverse('metrics'), HTTP_AUTHORIZATION='Bearer metrics-token'
+        )
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        for line in (
+            'yatube_request_duration_seconds_count{view="posts:index"} 2',
+            'yatube_request_duration_seconds_count{view="posts:profile"} 1',
+            'yatube_template_render_seconds_count{view="posts:index"} 2',
+            'yatube_response_size_bytes_count{view="posts:index"} 2',
+            'yatube_page_cache_hits_total{view="posts:index"} 1',
+            'yatube_page_cache_misses_total{view="posts:index"} 1',
+            'yatube_responses_total{view="posts:index",status="200"} 2',
+        ):
+            self.assertIn(line, text)
+        self.assertIn(
+            'yatube_db_queries_bucket{view="posts:index",le="0"} 1', text
+        )
+        self.assertNotIn('view="metrics"', text)
+
+    def test_metrics_need_token(self):
+        """Метрики не видны без токена, даже с локального адреса."""
+        for authorization in ('', 'Bearer wrong-token'):
+            with self.subTest(authorization=authorization):
+                response = self.client.get(
+                    reverse('metrics'), REMOTE_ADDR='127.0.0.1',
+                    HTTP_AUTHORIZATION=authorization
+                )
+                self.assertEqual(response.status_code, 404)
+        with override_settings(METRICS_TOKEN=''):
+            response = self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION='Bearer '
+            )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(TestCase):
+    """Реплику изображает отдельный файл SQLite, в который ничего
+    не реплицируется: всё, что видно с неё, прочитано не с default."""
+
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Primary')
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_author = Client()
+        self.authorized_author.force_login(self.author)
+
+    def test_reads_go_to_replica(self):
+        """Чтения из запроса идут на реплику, вне запроса — на default."""
+        Post.objects.create(author=self.author, text='Только на default')
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'Только на default')
+        self.assertEqual(
+            db_router.ReplicaRouter().db_for_read(Post), 'default'
+        )
+
+    def test_writer_is_pinned_to_primary(self):
+        """Автор сразу видит свой пост, остальные читают реплику."""
+        response = self.authorized_author.post(
+            reverse('posts:post_create'), {'text': 'Свежий пост'}
+        )
+        pin = response.cookies[settings.REPLICA_PIN_COOKIE]
+        self.assertEqual(pin['max-age'], settings.REPLICA_PIN_SECONDS)
+        self.assertContains(
+            self.authorized_author.get(reverse('posts:index')),
+            'Свежий пост'
+        )
+        self.assertNotContains(
+            self.client.get(reverse('posts:index')), 'Свежий пост'
+        )
+
+    @override_settings(WRITE_BEHIND_ENABLED=True, WRITE_BEHIND_WAIT=0)
+    def test_queued_write_pins_client_to_primary(self):
+        """Подписка через очередь тоже прилепляет клиента к default."""
+        # Реплика знает и автора, и того, на кого он подписывается.
+        User.objects.using('replica').bulk_create([
+            User(
+                pk=self.author.pk, username=self.author.username,
+                password=self.author.password
+            ),
+            User(username='Followed'),
+        ])
+        queue = write_behind.write_queue
+        with mock.patch.object(queue, '_start'), \
+                mock.patch.object(queue, '_queue'), \
+                self.assertLogs('posts.write_behind', 'WARNING'):
+            response = self.authorized_author.get(reverse(
+                'posts:profile_follow', kwargs={'username': 'Followed'}
+            ))
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_lagging_replica_pages_are_not_cached(self):
+        """Страница с реплики сразу после записи не попадает в кэш."""
+        self.authorized_author.post(
+            reverse('posts:post_create'), {'text': 'Запись'}
+        )
+        self.client.get(reverse('posts:index'))
+        with CaptureQueriesContext(connections['replica']) as replica:
+            with self.assertNumQueries(0, using='default'):
+                self.client.get(reverse('posts:index'))
+        self.assertTrue(replica.captured_queries)
+
+    def copy_to_replica(self, *objects):
+        for obj in objects:
+            type(obj).objects.using('replica').bulk_create([obj])
+
+    def test_lagging_replica_reads_are_not_cached(self):
+        """Граф подписок, снимок пользователя, карточки и Last-Modified,
+        прочитанные с реплики сразу после записи, в кэш не попадают."""
+        author = User.objects.get(pk=self.author.pk)
+        followed = User.objects.create_user(username='Followed')
+        post = Post.objects.create(author=self.author, text='Новый текст')
+        self.copy_to_replica(
+            User.objects.get(pk=self.author.pk),
+            Post(
+                pk=post.pk, author_id=self.author.pk, text='Старый текст',
+                pub_date=post.pub_date
+            ),
+        )
+        Follow.objects.create(user=self.author, author=followed)
+        author.set_password('new-password')
+        author.save()
+
+        state, token = db_router.start_request(pinned=False)
+        try:
+            self.assertEqual(list(follow_graph.following(self.author.pk)), [])
+            self.assertNotEqual(
+                CachedModelBackend().get_user(self.author.pk).password,
+                author.password
+            )
+        finally:
+            db_router.finish_request(token)
+        index_page = reverse('posts:index')
+        self.assertContains(self.client.get(index_page), 'Старый текст')
+
+        self.assertEqual(
+            list(follow_graph.following(self.author.pk)), [followed.pk]
+        )
+        self.assertEqual(
+            CachedModelBackend().get_user(self.author.pk).password,
+            author.password
+        )
+        request = RequestFactory().get(index_page)
+        request.user = AnonymousUser()
+        tags = cache_tags.index_tags(request)
+        self.assertIsNone(cache.get(
+            'modified:' + page_digest(request, tags, get_tag_versions(tags))
+        ))
+        self.client.cookies[settings.REPLICA_PIN_COOKIE] = '1'
+        self.assertContains(self.client.get(index_page), 'Новый текст')
+
+
+class TemplateFragmentsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='Inliner')
+        group = Group.objects.create(
+            title='Группа', slug='inline', description='Описание'
+        )
+        for n in range(3):
+            Post.objects.create(author=author, group=group, text=f'Пост {n}')
+
+    def render(self, source):
+        request = RequestFactory().get('/')
+        posts = Post.objects.for_feed()
+        return engines.all()[0].from_string(
+            '{% load fragments %}' + source
+        ).render({'posts': posts}, request)
+
+    def test_inline_renders_like_include(self):
+        """{% inline %} даёт тот же HTML, что и {% include %}."""
+        self.assertEqual(
+            self.render(
+                '{% for post in posts %}'
+                "{% inline 'posts/includes/posts_list.html' %}"
+                '{% endfor %}'
+            ),
+            self.render(
+                '{% for post in posts %}'
+                "{% include 'posts/includes/posts_list.html' %}"
+                '{% endfor %}'
+            )
+        )
+
+    def test_inline_rejects_extending_templates(self):
+        """Шаблон с extends вшить нельзя."""
+        with self.assertRaises(TemplateSyntaxError):
+            self.render("{% inline 'posts/index.html' %}")
+
+    def test_warm_up_fills_cached_loader(self):
+        """Прогрев компилирует шаблоны проекта в кэширующий загрузчик."""
+        cached = [{
+            **settings.TEMPLATES[0],
+            'APP_DIRS': False,
+            'OPTIONS': {
+                **settings.TEMPLATES[0]['OPTIONS'],
+                'loaders': [(
+                    'django.template.loaders.cached.Loader', [
+                        'django.template.loaders.filesystem.Loader',
+                        'django.template.loaders.app_directories.Loader',
+                    ]
+                )],
+            },
+        }]
+        with override_settings(TEMPLATES=cached):
+            self.assertGreater(warm_up(), 0)
+            loader = engines.all()[0].engine.template_loaders[0]
+            self.assertIn('posts/index.html', loader.get_template_cache)
+            self.assertIn(
+                'posts/includes/posts_list.html', loader.get_template_cache
+            )
+
+
+class PostCardCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(
+            username='CardAuthor', first_name='Иван', last_name='Картов'
+        )
+        cls.group = Group.objects.create(
+            title='Карточки', slug='cards', description='Описание'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Текст карточки'
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def get_index(self):
+        # Страница целиком из кэша не берётся, карточки — берутся.
+        bump_tags(cache_tags.POSTS)
+        return self.client.get(reverse('posts:index'))
+
+    def test_page_is_built_from_cached_cards(self):
+        """Повторная отрисовка ленты берёт карточку из кэша."""
+        self.get_index()
+        posts = Post.objects.for_feed()
+        (key, html, _), = cached_cards(posts).values()
+        self.assertIn('Текст карточки', html)
+        cache.set(key, '<article>Карточка из кэша</article>')
+        self.assertContains(self.get_index(), 'Карточка из кэша')
+
+    def test_profile_cards_are_cached_separately(self):
+        """В профиле карточка без строки об авторе — свой вариант."""
+        self.get_index()
+        response = self.client.get(
+            reverse('posts:profile', args=(self.author.username,))
+        )
+        self.assertNotContains(response, 'все посты пользователя')
+
+    def test_card_does_not_depend_on_request_path(self):
+        """Адрес с «profile» не прячет автора в общей карточке."""
+        group = Group.objects.create(title='Фанаты', slug='profile-fans')
+        Post.objects.filter(pk=self.post.pk).update(group=group)
+        bump_tags(cache_tags.post_tag(self.post.pk))
+        response = self.client.get(
+            reverse('posts:group_list', args=(group.slug,))
+        )
+        self.assertContains(response, 'все посты пользователя')
+        self.assertContains(self.get_index(), 'все посты пользователя')
+
+    def test_cards_follow_post_author_and_group_changes(self):
+        """Правка поста, переименования автора и группы видны сразу."""
+        self.get_index()
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Исправленный текст'
+        post.save()
+        self.assertContains(self.get_index(), 'Исправленный текст')
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name = 'Пётр'
+        author.save()
+        self.assertContains(self.get_index(), 'Пётр Картов')
+        Group.objects.filter(pk=self.group.pk).update(title='Новая группа')
+        self.assertContains(self.get_index(), 'Новая группа')
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Conditional')
+        cls.reader = User.objects.create_user(username='ConditionalReader')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_unchanged_page_is_not_modified(self):
+        """Повторный запрос с ETag получает 304 без шаблона и базы."""
+        page = reverse('posts:index')
+        with self.later():
+            response = self.client.get(page)
+            self.assertTrue(response.has_header('Last-Modified'))
+            with self.assertNumQueries(0):
+                repeated = self.client.get(
+                    page, HTTP_IF_NONE_MATCH=response['ETag']
+                )
+            self.assertEqual(repeated.status_code, 304)
+            self.assertFalse(repeated.templates)
+            self.assertEqual(
+                self.client.get(
+                    page, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+                ).status_code,
+                304
+            )
+
+    def later(self):
+        # Last-Modified отдаётся, когда с изменения прошла секунда.
+        return mock.patch('time.time', return_value=time.time() + 5)
+
+    def test_fresh_change_has_no_last_modified(self):
+        """В ту же секунду, что и запись, проверяется только ETag."""
+        response = self.client.get(reverse('posts:index'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertTrue(response.has_header('ETag'))
+
+    def test_follow_changes_last_modified(self):
+        """Подписка сбрасывает 304 и по одному If-Modified-Since."""
+        profile = reverse('posts:profile', args=(self.author.username,))
+        hour_ago = timezone.now() - timedelta(hours=1)
+        Post.objects.filter(pk=self.post.pk).update(updated_at=hour_ago)
+        cache.set_many({
+            TAG_PREFIX + tag: int(hour_ago.timestamp() * 10 ** 9)
+            for tag in cache_tags.profile_tags(None, self.author.username)
+        }, None)
+        modified = self.reader_client.get(profile)['Last-Modified']
+        Follow.objects.create(user=self.reader, author=self.author)
+        response = self.reader_client.get(
+            profile, HTTP_IF_MODIFIED_SINCE=modified
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Отписаться')
+
+    def test_edits_comments_and_follows_change_validators(self):
+        """Правка поста, комментарий и подписка дают новый ответ."""
+        pages = {
+            'index': reverse('posts:index'),
+            'post_detail': reverse(
+                'posts:post_detail', args=(self.post.pk,)
+            ),
+            'profile': reverse(
+                'posts:profile', args=(self.author.username,)
+            ),
+        }
+        etags = {}
+        for name, page in pages.items():
+            self.reader_client.get(page)
+            etags[name] = self.reader_client.get(page)['ETag']
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Исправленный пост'
+        post.save()
+        Comment.objects.create(post=post, author=self.reader, text='Ответ')
+        Follow.objects.create(user=self.reader, author=self.author)
+        for name, page in pages.items():
+            with self.subTest(page=name):
+                response = self.reader_client.get(
+                    page, HTTP_IF_NONE_MATCH=etags[name]
+                )
+                self.assertEqual(response.status_code, 200)
+        post.refresh_from_db()
+        self.assertGreater(post.updated_at, post.pub_date)
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(
+            username='Exporter', is_staff=True
+        )
+        cls.author = User.objects.create_user(username='Exported')
+        cls.old_post = Post.objects.create(
+            author=cls.author, text='Старый пост'
+        )
+        cls.new_post = Post.objects.create(
+            author=cls.author, text='Новый пост'
+        )
+        Post.objects.filter(pk=cls.old_post.pk).update(
+            updated_at=cls.new_post.updated_at - timedelta(days=1)
+        )
+        Comment.objects.create(
+            post=cls.new_post, author=cls.staff, text='Комментарий'
+        )
+
+    def setUp(self):
+        self.staff_client = Client()
+        self.staff_client.force_login(self.staff)
+
+    def get(self, table, **params):
+        return self.staff_client.get(
+            reverse('posts:export', args=(table,)), params
+        )
+
+    def test_export_is_for_staff_only(self):
+        """Выгрузка недоступна обычным пользователям."""
+        client = Client()
+        client.force_login(self.author)
+        response = client.get(reverse('posts:export', args=('posts',)))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.get('users').status_code, 404)
+        self.assertEqual(self.get('posts', format='xml').status_code, 400)
+
+    def test_ndjson_export_since_watermark(self):
+        """NDJSON построчно и только строки новее метки."""
+        response = self.get('posts')
+        self.assertTrue(response.streaming)
+        rows = [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(
+            [row['text'] for row in rows], ['Старый пост', 'Новый пост']
+        )
+        response = self.get(
+            'posts', since=(
+                self.new_post.updated_at - timedelta(hours=1)
+            ).isoformat()
+        )
+        rows = b''.join(response.streaming_content).splitlines()
+        self.assertEqual(
+            [json.loads(row)['id'] for row in rows], [self.new_post.pk]
+        )
+        self.assertEqual(
+            self.get(
+                'posts', since=response['X-Export-Watermark']
+            ).getvalue(),
+            b''
+        )
+
+    def test_gzipped_csv_export(self):
+        """CSV сжимается gzip на лету."""
+        response = self.get('comments', format='csv', gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        content = gzip.decompress(b''.join(response.streaming_content))
+        header, row = csv.reader(StringIO(content.decode()))
+        self.assertEqual(
+            header, ['id', 'post_id', 'author_id', 'text', 'created']
+        )
+        self.assertEqual(row[3], 'Комментарий')
+
+    def test_export_command_writes_files(self):
+        """export_yatube пишет по файлу на таблицу."""
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        out = StringIO()
+        call_command(
+            'export_yatube', 'follows', 'groups', '--gzip',
+            '--output-dir', output_dir, stdout=out
+        )
+        self.assertEqual(
+            sorted(os.listdir(output_dir)),
+            ['follows.ndjson.gz', 'groups.ndjson.gz']
+        )
+        self.assertIn('--since', out.getvalue())
+
+
+class SessionCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='SessionUser', password='old-password'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.login(
+            username='SessionUser', password='old-password'
+        )
+
+    def test_session_and_user_come_from_cache(self):
+        """Повторный запрос не читает ни django_session, ни auth_user."""
+        page = reverse('posts:follow_index')
+        self.authorized_client.get(page)
+        with CaptureQueriesContext(connection) as queries:
+            self.authorized_client.get(page)
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('django_session', tables)
+        self.assertNotIn('"auth_user"."password"', tables)
+
+    def test_password_change_ends_cached_sessions(self):
+        """Смена пароля сбрасывает снимок пользователя и сессии."""
+        page = reverse('posts:follow_index')
+        self.assertEqual(self.authorized_client.get(page).status_code, 200)
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new-password')
+        user.save()
+        self.assertEqual(self.authorized_client.get(page).status_code, 302)
+
+    def test_unchanged_session_is_not_saved(self):
+        """Сессия без изменений не пишется ни в базу, ни в кэш."""
+        store = SessionStore(self.authorized_client.session.session_key)
+        store['_auth_user_id'] = store['_auth_user_id']
+        with self.assertNumQueries(0), mock.patch.object(
+            store._cache, 'set'
+        ) as cache_set:
+            store.save()
+        cache_set.assert_not_called()
+
+    def test_changed_session_reaches_db_lazily(self):
+        """Изменённая сессия сразу попадает в кэш, а в базу — не чаще
+        раза в SESSION_DB_SAVE_INTERVAL."""
+        session_key = self.authorized_client.session.session_key
+        store = SessionStore(session_key)
+        store['visited'] = 1
+        with self.assertNumQueries(0):
+            store.save()
+        self.assertEqual(SessionStore(session_key)['visited'], 1)
+        store['visited'] = 2
+        later = mock.patch(
+            'time.time',
+            return_value=time.time() + settings.SESSION_DB_SAVE_INTERVAL
+        )
+        with later, CaptureQueriesContext(connection) as queries:
+            store.save()
+        self.assertTrue(any(
+            query['sql'].startswith('UPDATE "django_session"')
+            for query in queries
+        ))
+        cache.clear()
+        self.assertEqual(SessionStore(session_key)['visited'], 2)
+
+
+class PageCacheStampedeTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='Stampede')
+        cls.post = Post.objects.create(author=author, text='Старый текст')
+
+    def setUp(self):
+        cache.clear()
+
+    def index_key(self):
+        request = RequestFactory().get(reverse('posts:index'))
+        request.user = AnonymousUser()
+        tags = cache_tags.index_tags(request)
+        return page_cache_key(
+            request, views.index, tags, get_tag_versions(tags)
+        )
+
+    def change_text_quietly(self, text):
+        # update() не сдвигает теги, и ключ страницы остаётся прежним.
+        Post.objects.filter(pk=self.post.pk).update(text=text)
+
+    def client_with_csrf_cookie(self, token):
+        client = Client()
+        client.cookies[settings.CSRF_COOKIE_NAME] = token * 64
+        return client
+
+    def test_page_without_token_is_shared_across_csrf_cookies(self):
+        """Страница без CSRF-токена общая для клиентов с разной кукой."""
+        index_page = reverse('posts:index')
+        self.client_with_csrf_cookie('a').get(index_page)
+        rendering = mock.patch(
+            'core.cache.render', wraps=core_cache.render
+        )
+        with rendering as render:
+            self.client_with_csrf_cookie('b').get(index_page)
+        render.assert_not_called()
+
+    def test_page_with_token_is_cached_per_csrf_cookie(self):
+        """Страница с CSRF-токеном не отдаётся клиенту с другой кукой."""
+        User.objects.create_user(username='Commenter', password='password')
+        detail_page = reverse('posts:post_detail', args=(self.post.pk,))
+        first, second = map(self.client_with_csrf_cookie, 'ab')
+        for client in (first, second):
+            client.login(username='Commenter', password='password')
+        first.get(detail_page)
+        self.change_text_quietly('Новый текст')
+        self.assertContains(first.get(detail_page), 'Старый текст')
+        self.assertContains(second.get(detail_page), 'Новый текст')
+
+    @override_settings(PAGE_CACHE_TIMEOUT=1, PAGE_CACHE_STALE_SECONDS=60)
+    def test_stale_page_is_served_while_another_worker_renders(self):
+        """Просроченная копия отдаётся, пока страницу считает другой."""
+        index_page = reverse('posts:index')
+        self.client.get(index_page)
+        self.change_text_quietly('Новый текст')
+        later = mock.patch('time.time', return_value=time.time() + 2)
+        rendering = mock.patch(
+            'core.cache.render', wraps=core_cache.render
+        )
+        with later, rendering as render:
+            cache.set(LOCK_PREFIX + self.index_key(), 1)
+            self.assertContains(self.client.get(index_page), 'Старый текст')
+            render.assert_not_called()
+            cache.delete(LOCK_PREFIX + self.index_key())
+            self.client.get(index_page)
+            render.assert_called_once()
+
+    def test_concurrent_miss_waits_for_lock_holder(self):
+        """При пустом кэше запрос ждёт страницу от держателя замка."""
+        key = self.index_key()
+        cache.set(LOCK_PREFIX + key, 1)
+        rendered = HttpResponse('Страница от другого воркера')
+
+        def finish_render():
+            time.sleep(0.2)
+            cache.set(key, (rendered, time.time() + 60, 0.01))
+            cache.delete(LOCK_PREFIX + key)
+
+        worker = threading.Thread(target=finish_render)
+        worker.start()
+        response = self.client.get(reverse('posts:index'))
+        worker.join()
+        self.assertEqual(
+            response.content.decode(), 'Страница от другого воркера'
+        )
+
+    def test_early_expiry_grows_near_deadline(self):
+        """Долгая страница пересчитывается заранее, быстрая — в срок."""
+        now = time.time()
+        with mock.patch('random.random', return_value=0.99):
+            self.assertTrue(needs_refresh(now + 1, 0.5, now))
+            self.assertFalse(needs_refresh(now + 60, 0.5, now))
+            self.assertFalse(needs_refresh(now + 1, 0, now))
+            self.assertTrue(needs_refresh(now, 0, now))
+
+
+class UserTagsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='Named')
+
+    def users_version(self):
+        return get_tag_versions([cache_tags.USERS])[0]
+
+    def test_signup_and_login_keep_pages(self):
+        """Регистрация и вход не сбрасывают кэш страниц."""
+        version = self.users_version()
+        User.objects.create_user(username='Newcomer')
+        self.client.force_login(self.user)
+        self.user.email = 'named@example.com'
+        self.user.save()
+        self.assertEqual(self.users_version(), version)
+
+    def test_rename_bumps_user_pages(self):
+        """Смена имени сбрасывает страницы, где оно видно."""
+        version = self.users_version()
+        self.user.first_name = 'Новое имя'
+        self.user.save()
+        self.assertNotEqual(self.users_version(), version)
+
+
+class TagBumpOnCommitTest(TransactionTestCase):
+    def test_pages_rendered_before_commit_are_retired(self):
+        """Теги сдвигаются ещё раз после коммита транзакции."""
+        author = User.objects.create_user(username='Committer')
+        tag = cache_tags.author_tag(author.pk)
+        with transaction.atomic():
+            Post.objects.create(author=author, text='Пост из админки')
+            during = get_tag_versions([tag])
+        self.assertNotEqual(get_tag_versions([tag]), during)
+
+
+class UserSnapshotOnCommitTest(TransactionTestCase):
+    def test_snapshot_cached_before_commit_is_dropped(self):
+        """Снимок, закэшированный до коммита смены пароля, сбрасывается."""
+        user = User.objects.create_user(username='Committer')
+        stale = User.objects.get(pk=user.pk)
+        with transaction.atomic():
+            user.set_password('new-password')
+            user.save()
+            version, = get_tag_versions([user_tag(user.pk)])
+            cache.set(user_key(user.pk, version), stale)
+        self.assertEqual(
+            CachedModelBackend().get_user(user.pk).password, user.password
+        )
+
+
+class WriteBehindTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.author = User.objects.create_user(username='Writer')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+
+    def operation(self, kind, obj):
+        return write_behind.Operation(kind, obj, None)
+
+    def test_batch_keeps_counters_feeds_and_pages(self):
+        """Пачка обновляет счётчики, ленты и теги, как сигналы."""
+        pair = (self.reader.pk, self.author.pk)
+        versions = get_tag_versions([
+            cache_tags.post_tag(self.post.pk),
+            cache_tags.author_tag(self.author.pk),
+        ])
+        write_behind.write_batch([
+            self.operation(write_behind.COMMENT, Comment(
+                post=self.post, author=self.reader, text=f'Комментарий {n}'
+            ))
+            for n in range(3)
+        ] + [self.operation(write_behind.FOLLOW, pair)])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 3)
+        self.assertEqual(self.post.comments.count(), 3)
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.followers_count, 1)
+        self.reader.stats.refresh_from_db()
+        self.assertEqual(self.reader.stats.following_count, 1)
+        self.assertTrue(FeedEntry.objects.filter(
+            user=self.reader, post=self.post
+        ).exists())
+        for old, new in zip(versions, get_tag_versions([
+            cache_tags.post_tag(self.post.pk),
+            cache_tags.author_tag(self.author.pk),
+        ])):
+            self.assertNotEqual(old, new)
+
+    def test_cache_error_after_commit_does_not_write_twice(self):
+        """Сбой кэша после коммита не повторяет запись пачки."""
+        operations = [
+            write_behind.Operation(write_behind.COMMENT, Comment(
+                post=self.post, author=self.reader, text=f'Комментарий {n}'
+            ), futures.Future())
+            for n in range(2)
+        ]
+        with mock.patch(
+            'posts.write_behind.bump_tags', side_effect=OSError('занято')
+        ):
+            write_behind._write(operations)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments.count(), 2)
+        self.assertEqual(self.post.comments_count, 2)
+        for operation in operations:
+            self.assertTrue(operation.future.done())
+            self.assertIsNone(operation.future.exception())
+
+    def test_last_follow_operation_of_pair_wins(self):
+        """Подписка и отписка одной пары в пачке дают последнее."""
+        pair = (self.reader.pk, self.author.pk)
+        write_behind.write_batch([
+            self.operation(write_behind.FOLLOW, pair),
+            self.operation(write_behind.UNFOLLOW, pair),
+        ])
+        self.assertFalse(Follow.objects.exists())
+        write_behind.write_batch([
+            self.operation(write_behind.FOLLOW, pair),
+            self.operation(write_behind.FOLLOW, pair),
+        ])
+        self.assertEqual(Follow.objects.count(), 1)
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.followers_count, 1)
+        write_behind.write_batch([self.operation(write_behind.UNFOLLOW, pair)])
+        self.assertFalse(Follow.objects.exists())
+        self.author.stats.refresh_from_db()
+        self.assertEqual(self.author.stats.followers_count, 0)
+
+
+@override_settings(WRITE_BEHIND_ENABLED=True, WRITE_BEHIND_MAX_DELAY=0.2)
+class WriteQueueTest(TransactionTestCase):
+    """Очередь пишет из своего потока, поэтому данные коммитятся."""
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='Reader')
+        self.author = User.objects.create_user(username='Writer')
+        self.post = Post.objects.create(author=self.author, text='Пост')
+
+    def tearDown(self):
+        write_behind.write_queue.flush()
+
+    def comment(self, post_id, text='Комментарий'):
+        return Comment(post_id=post_id, author=self.reader, text=text)
+
+    def test_queued_writes_share_one_transaction(self):
+        """Операции, пришедшие вместе, пишутся одной пачкой."""
+        with mock.patch(
+            'posts.write_behind.write_batch', wraps=write_behind.write_batch
+        ) as write_batch:
+            pending = [
+                write_behind.write_queue.submit(
+                    write_behind.COMMENT, self.comment(self.post.pk)
+                )
+                for _ in range(5)
+            ] + [write_behind.write_queue.submit(
+                write_behind.FOLLOW, (self.reader.pk, self.author.pk)
+            )]
+            for future in pending:
+                future.result(5)
+        write_batch.assert_called_once()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 5)
+        self.assertTrue(Follow.objects.filter(
+            user=self.reader, author=self.author
+        ).exists())
+
+    def test_bad_operation_does_not_sink_batch(self):
+        """Комментарий к удалённому посту не мешает остальным."""
+        good = write_behind.write_queue.submit(
+            write_behind.COMMENT, self.comment(self.post.pk, 'Хороший')
+        )
+        bad = write_behind.write_queue.submit(
+            write_behind.COMMENT, self.comment(self.post.pk + 100, 'Плохой')
+        )
+        self.assertEqual(good.result(5).text, 'Хороший')
+        with self.assertRaises(IntegrityError):
+            bad.result(5)
+        self.assertEqual(Comment.objects.get().text, 'Хороший')
+
+    def test_unfollow_bumps_graph_again_after_commit(self):
+        """Списки, собранные до коммита отписки, не читаются после него."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        tag = follow_graph.graph_tag(follow_graph.FOLLOWERS, self.author.pk)
+        with transaction.atomic():
+            write_behind.write_batch([write_behind.Operation(
+                write_behind.UNFOLLOW, (self.reader.pk, self.author.pk), None
+            )])
+            during = get_tag_versions([tag])
+        self.assertNotEqual(get_tag_versions([tag]), during)
+        self.assertEqual(list(follow_graph.followers(self.author.pk)), [])
+
+    def test_author_sees_own_comment_after_redirect(self):
+        """После редиректа автор видит свой комментарий."""
+        client = Client()
+        client.force_login(self.reader)
+        detail = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        client.get(detail)
+        response = client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': 'Мой комментарий'}, follow=True
+        )
+        self.assertRedirects(response, detail)
+        self.assertContains(response, 'Мой комментарий')
+
+
+class FollowGraphTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader, cls.first, cls.second, cls.third = [
+            User.objects.create_user(username=name)
+            for name in ('Reader', 'First', 'Second', 'Third')
+        ]
+        for user, author in (
+            (cls.reader, cls.second),
+            (cls.reader, cls.first),
+            (cls.first, cls.third),
+            (cls.second, cls.third),
+            (cls.second, cls.reader),
+            (cls.first, cls.reader),
+        ):
+            Follow.objects.create(user=user, author=author)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_reader = Client()
+        self.authorized_reader.force_login(self.reader)
+
+    def test_lists_are_sorted_and_cached(self):
+        """Списки подписок отсортированы и второй раз берутся из кэша."""
+        expected = sorted([self.first.pk, self.second.pk])
+        self.assertEqual(
+            list(follow_graph.following(self.reader.pk)), expected
+        )
+        follow_graph.followers(self.reader.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                list(follow_graph.following(self.reader.pk)), expected
+            )
+            self.assertEqual(
+                list(follow_graph.followers(self.reader.pk)), expected
+            )
+            self.assertTrue(
+                follow_graph.is_following(self.reader.pk, self.first.pk)
+            )
+            self.assertFalse(
+                follow_graph.is_following(self.reader.pk, self.third.pk)
+            )
+            self.assertEqual(follow_graph.mutuals(self.reader.pk), expected)
+
+    def test_follow_and_unfollow_replace_cached_lists(self):
+        """Подписка и отписка сразу видны в графе."""
+        self.assertFalse(
+            follow_graph.is_following(self.reader.pk, self.third.pk)
+        )
+        profile = {'username': self.third.username}
+        self.authorized_reader.get(
+            reverse('posts:profile_follow', kwargs=profile)
+        )
+        self.assertTrue(
+            follow_graph.is_following(self.reader.pk, self.third.pk)
+        )
+        self.assertIn(self.reader.pk, follow_graph.followers(self.third.pk))
+        self.authorized_reader.get(
+            reverse('posts:profile_unfollow', kwargs=profile)
+        )
+        self.assertFalse(
+            follow_graph.is_following(self.reader.pk, self.third.pk)
+        )
+
+    def test_follower_profile_shows_new_following_count(self):
+        """Подписка обновляет число подписок в профиле подписчика."""
+        profile = reverse(
+            'posts:profile', kwargs={'username': self.third.username}
+        )
+        self.client.get(profile)
+        self.assertContains(self.client.get(profile), 'подписок: 0')
+        third = Client()
+        third.force_login(self.third)
+        third.get(reverse(
+            'posts:profile_follow', kwargs={'username': self.reader.username}
+        ))
+        self.assertContains(self.client.get(profile), 'подписок: 1')
+
+    def test_suggestions_come_from_followed_authors(self):
+        """Лента советует тех, на кого подписаны подписки читателя."""
+        self.assertEqual(
+            follow_graph.suggestions(self.reader.pk), [(self.third.pk, 2)]
+        )
+        response = self.authorized_reader.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            response.context['suggestions'], [(self.third, 2)]
+        )
+        self.assertContains(response, reverse(
+            'posts:profile', kwargs={'username': self.third.username}
+        ))
@@ -0,0 +1,210 @@
+"""Фоновая нарезка миниатюр картинок постов.
+
+Сохранение поста с новой картинкой ставит ThumbnailJob в очередь, а
+воркер (команда thumbnail_worker или пул потоков при
+THUMBNAIL_WORKER_THREADS > 0) режет все пресеты THUMBNAIL_PRESETS
+через sorl-thumbnail и готовит варианты PostImageVariant для srcset.
+Шаблоны через lookup() берут только готовые миниатюры, так что запрос
+страницы никогда не ресайзит картинку сам.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from os.path import basename, splitext
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from core.cache import bump_tags
+
+from . import cache_tags
+from .models import PostImageVariant, ThumbnailJob
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+class LookupBackend(ThumbnailBackend):
+    """Ищет миниатюру в KVStore sorl, ничего не создавая."""
+
+    def lookup(self, file_, geometry_string, **options):
+        source = ImageFile(file_)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+
+_lookup_backend = LookupBackend()
+
+
+def lookup(image, preset):
+    """Готовая миниатюра пресета или None, если её ещё нет."""
+    if not image:
+        return None
+    geometry, options = settings.THUMBNAIL_PRESETS[preset]
+    return _lookup_backend.lookup(image, geometry, **options)
+
+
+def render_thumbnails(post):
+    for geometry, options in settings.THUMBNAIL_PRESETS.values():
+        get_thumbnail(post.image, geometry, **options)
+
+
+def _card_height(width):
+    geometry, _ = settings.THUMBNAIL_PRESETS['card']
+    card_width, card_height = map(int, geometry.split('x'))
+    return round(width * card_height / card_width)
+
+
+def _dominant_color(image):
+    red, green, blue = image.resize((1, 1), Image.LANCZOS).getpixel((0, 0))
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def render_variants(post):
+    """Готовит варианты картинки поста для srcset в кадре карточки."""
+    with post.image.open('rb'):
+        source = Image.open(post.image)
+        source = ImageOps.exif_transpose(source).convert('RGB')
+    color = _dominant_color(source)
+    stem = splitext(basename(post.image.name))[0]
+    drop_variants(post)
+    formats = [
+        image_format for image_format in settings.POST_IMAGE_FORMATS
+        if image_format != 'WEBP' or features.check('webp')
+    ]
+    for width in settings.POST_IMAGE_WIDTHS:
+        size = (width, _card_height(width))
+        resized = ImageOps.fit(source, size, Image.LANCZOS)
+        for image_format in formats:
+            buffer = BytesIO()
+            resized.save(
+                buffer, image_format,
+                quality=settings.POST_IMAGE_QUALITY, optimize=True
+            )
+            variant = PostImageVariant(
+                post=post,
+                format=image_format.lower(),
+                width=size[0],
+                height=size[1],
+                size=buffer.tell(),
+                color=color
+            )
+            variant.image.save(
+                f'{stem}_{width}.{image_format.lower()}',
+                ContentFile(buffer.getvalue()),
+                save=False
+            )
+            variant.save()
+
+
+def drop_variants(post):
+    """Удаляет варианты картинки поста, например прежней картинки."""
+    variants = list(post.image_variants.all())
+    if not variants:
+        return
+    PostImageVariant.objects.filter(
+        pk__in=[variant.pk for variant in variants]
+    ).delete()
+    # Файлы удаляются, только когда строки точно ушли из базы.
+    transaction.on_commit(lambda: [
+        variant.image.delete(save=False) for variant in variants
+    ])
+
+
+def enqueue(post):
+    """Ставит нарезку миниатюр поста в очередь."""
+    ThumbnailJob.objects.update_or_create(
+        post=post,
+        defaults={'status': ThumbnailJob.PENDING, 'attempts': 0}
+    )
+    if settings.THUMBNAIL_WORKER_THREADS:
+        transaction.on_commit(_kick_executor)
+
+
+def _kick_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.THUMBNAIL_WORKER_THREADS,
+            thread_name_prefix='thumbnails'
+        )
+    _executor.submit(_process_in_thread)
+
+
+def _process_in_thread():
+    try:
+        process_pending()
+    except Exception:
+        logger.exception('Очередь миниатюр упала')
+    finally:
+        close_old_connections()
+
+
+def _claim(job):
+    """Забирает задачу себе; False, если её уже взял другой воркер."""
+    return ThumbnailJob.objects.filter(
+        pk=job.pk, status=job.status, updated=job.updated
+    ).update(status=ThumbnailJob.RUNNING, updated=timezone.now()) == 1
+
+
+def _run(job):
+    post = job.post
+    try:
+        if post.image:
+            render_thumbnails(post)
+            render_variants(post)
+    except Exception as error:
+        logger.exception('Не удалось нарезать миниатюры поста %s', post.pk)
+        job.attempts += 1
+        job.error = str(error)
+        job.status = (
+            ThumbnailJob.FAILED
+            if job.attempts >= settings.THUMBNAIL_JOB_MAX_ATTEMPTS
+            else ThumbnailJob.PENDING
+        )
+    else:
+        job.status = ThumbnailJob.DONE
+        job.error = ''
+        # Закэшированные страницы ещё показывают оригинал картинки.
+        bump_tags(*cache_tags.post_tags(post))
+    job.save(update_fields=('status', 'attempts', 'error', 'updated'))
+    return job.status == ThumbnailJob.DONE
+
+
+def process_pending(limit=None):
+    """Разбирает очередь и возвращает число готовых задач.
+
+    Задачи, застрявшие в работе дольше THUMBNAIL_JOB_TIMEOUT (воркер
+    умер на полпути), берутся заново.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.THUMBNAIL_JOB_TIMEOUT)
+    done = 0
+    while limit is None or done < limit:
+        job = ThumbnailJob.objects.select_related('post').filter(
+            status=ThumbnailJob.PENDING
+        ).first() or ThumbnailJob.objects.select_related('post').filter(
+            status=ThumbnailJob.RUNNING, updated__lt=stale
+        ).first()
+        if job is None:
+            break
+        if _claim(job):
+            done += _run(job)
+    return done
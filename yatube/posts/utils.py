@@ -1,9 +1,184 @@
+import base64
+import binascii
+import hashlib
+from contextlib import contextmanager
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+def encode_cursor(post):
+    """Упаковывает ключ (pub_date, id) поста в строку для URL."""
+    raw = f'{post.pub_date.isoformat()}|{post.pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Возвращает (pub_date, id) или None, если курсор испорчен."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        pub_date, pk = raw.decode().split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, pk
+
+
+class KeysetPage(Page):
+    """Страница, которая знает о соседях без подсчёта всех записей."""
+
+    def __init__(self, object_list, number, paginator,
+                 has_next, has_previous):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    @property
+    def next_cursor(self):
+        if not self.object_list:
+            return ''
+        return encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.object_list:
+            return ''
+        return encode_cursor(self.object_list[0])
 
+    @property
+    def page_window(self):
+        """Номера страниц вокруг текущей для полосы навигации."""
+        radius = settings.PAGINATOR_WINDOW
+        last = max(self.paginator.num_pages, self.number)
+        return range(
+            max(1, self.number - radius),
+            min(last, self.number + radius) + 1
+        )
 
-def get_page_obj(request, posts):
-    paginator = Paginator(posts, settings.POSTS_PER_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+
+class KeysetPaginator(Paginator):
+    """Пагинатор по ключу (pub_date, id) вместо OFFSET.
+
+    Ссылки «вперёд» и «назад» несут курсор крайнего поста страницы,
+    поэтому запрос стоит одинаково на первой и на тысячной странице.
+    Число страниц нужно только для полосы с номерами и считается
+    приблизительно: результат COUNT(*) живёт в кэше
+    PAGINATOR_COUNT_TIMEOUT секунд.
+
+    key называет поля с теми же значениями, что pub_date и pk поста;
+    ленте подписок это позволяет сортировать и искать по индексу
+    FeedEntry.
+    """
+
+    def __init__(self, object_list, per_page, approximate_count=True,
+                 key=('pub_date', 'pk')):
+        self.date_field, self.pk_field = key
+        super().__init__(
+            object_list.order_by(f'-{self.date_field}', f'-{self.pk_field}'),
+            per_page
+        )
+        self.approximate_count = approximate_count
+
+    @cached_property
+    def count(self):
+        query = str(self.object_list.query).encode()
+        key = 'paginator_count:' + hashlib.md5(query).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, settings.PAGINATOR_COUNT_TIMEOUT)
+        return count
+
+    def get_page(self, number, after=None, before=None):
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        after = decode_cursor(after)
+        before = decode_cursor(before)
+        if after:
+            return self._seek_page(number, after, backwards=False)
+        if before:
+            return self._seek_page(number, before, backwards=True)
+        return self._offset_page(number)
+
+    def _after(self, pub_date, pk, lookup):
+        date, key = self.date_field, self.pk_field
+        return (
+            Q(**{f'{date}__{lookup}': pub_date})
+            | Q(**{date: pub_date, f'{key}__{lookup}': pk})
+        )
+
+    def _seek_page(self, number, cursor, backwards):
+        pub_date, pk = cursor
+        limit = self.per_page + 1
+        if backwards:
+            rows = list(
+                self.object_list.filter(
+                    self._after(pub_date, pk, 'gt')
+                ).reverse()[:limit]
+            )
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(rows, number, self, True, has_more)
+        rows = list(
+            self.object_list.filter(self._after(pub_date, pk, 'lt'))[:limit]
+        )
+        has_more = len(rows) > self.per_page
+        return KeysetPage(rows[:self.per_page], number, self, has_more, True)
+
+    def _offset_page(self, number):
+        # Прямой переход по номеру из полосы навигации; первая страница
+        # обходится без OFFSET.
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and self.num_pages < number:
+            return self._offset_page(self.num_pages)
+        has_more = len(rows) > self.per_page
+        return KeysetPage(
+            rows[:self.per_page], number, self, has_more, number > 1
+        )
+
+
+def get_page_obj(request, posts, key=('pub_date', 'pk')):
+    paginator = KeysetPaginator(posts, settings.POSTS_PER_PAGE, key=key)
+    page_obj = paginator.get_page(
+        request.GET.get('page'),
+        after=request.GET.get('after'),
+        before=request.GET.get('before')
+    )
     return page_obj
+
+
+@contextmanager
+def keep_dates(*fields):
+    """Отключает auto_now_add, чтобы bulk_create сохранил свои даты."""
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in saved:
+            field.auto_now_add = value
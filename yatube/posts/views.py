@@ -1,16 +1,25 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
-from django.views.decorators.cache import cache_page
 
+from core.cache import cache_page_by_tags, condition_by_tags
+
+from . import cache_tags, export, feed, follow_graph, search, write_behind
 from .forms import PostForm, CommentForm
-from .models import Group, Post, User, Comment, Follow
+from .models import Group, Post, User
 from .utils import get_page_obj
 
 
-@cache_page(20, key_prefix='index_page')
+@condition_by_tags(
+    cache_tags.index_tags, cache_tags.index_modified
+)
+@cache_page_by_tags(cache_tags.index_tags)
 def index(request):
     template = 'posts/index.html'
-    posts = Post.objects.select_related('author').all()
+    posts = Post.objects.for_feed()
     page_obj = get_page_obj(request, posts)
     context = {
         'page_obj': page_obj
@@ -18,10 +27,14 @@ def index(request):
     return render(request, template, context)
 
 
+@condition_by_tags(
+    cache_tags.group_posts_tags, cache_tags.group_posts_modified
+)
+@cache_page_by_tags(cache_tags.group_posts_tags)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
+    posts = group.posts.for_feed()
     page_obj = get_page_obj(request, posts)
     context = {
         'group': group,
@@ -30,18 +43,22 @@ def group_posts(request, slug):
     return render(request, template, context)
 
 
+@condition_by_tags(
+    cache_tags.profile_tags, cache_tags.profile_modified
+)
+@cache_page_by_tags(cache_tags.profile_tags)
 def profile(request, username):
     template = 'posts/profile.html'
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.select_related('author')
+    author = get_object_or_404(
+        User.objects.select_related('stats'),
+        username=username
+    )
+    posts = author.posts.for_feed()
     page_obj = get_page_obj(request, posts)
     following = (
         request.user.is_authenticated
         and request.user != author
-        and Follow.objects.filter(
-            user=request.user,
-            author=author
-        ).exists()
+        and follow_graph.is_following(request.user.pk, author.pk)
     )
     context = {
         'page_obj': page_obj,
@@ -51,11 +68,16 @@ def profile(request, username):
     return render(request, template, context)
 
 
+@condition_by_tags(
+    cache_tags.post_detail_tags, cache_tags.post_detail_modified,
+    vary_on_csrf=True
+)
+@cache_page_by_tags(cache_tags.post_detail_tags, vary_on_csrf=True)
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(Post.objects.for_detail(), pk=post_id)
     form = CommentForm()
-    comments = Comment.objects.filter(post=post)
+    comments = post.comments.all()
     context = {
         'post': post,
         'form': form,
@@ -64,6 +86,19 @@ def post_detail(request, post_id):
     return render(request, template, context)
 
 
+def post_search(request):
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    paginator = Paginator(
+        search.search_posts(query), settings.POSTS_PER_PAGE
+    )
+    context = {
+        'query': query,
+        'page_obj': paginator.get_page(request.GET.get('page'))
+    }
+    return render(request, template, context)
+
+
 @login_required
 def post_create(request):
     template = 'posts/create_post.html'
@@ -113,17 +148,22 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        write_behind.save_comment(comment)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
     template = 'posts/follow_index.html'
-    posts = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_page_obj(request, posts)
+    posts = feed.feed_posts(request.user).for_feed()
+    page_obj = get_page_obj(request, posts, key=feed.FEED_KEY)
+    suggested = follow_graph.suggestions(request.user.pk)
+    authors = User.objects.in_bulk([pk for pk, _ in suggested])
     context = {
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        'suggestions': [
+            (authors[pk], count) for pk, count in suggested if pk in authors
+        ]
     }
     return render(request, template, context)
 
@@ -131,17 +171,51 @@ def follow_index(request):
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-    if not Follow.objects.filter(
-            user=request.user,
-            author=author
-    ).exists() and request.user != author:
-        Follow.objects.create(user=request.user, author=author)
+    if request.user != author and not follow_graph.is_following(
+            request.user.pk, author.pk
+    ):
+        write_behind.follow(request.user, author)
     return redirect('posts:profile', username)
 
 
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    following = Follow.objects.filter(user=request.user, author=author)
-    following.delete()
+    if follow_graph.is_following(request.user.pk, author.pk):
+        write_behind.unfollow(request.user, author)
     return redirect('posts:profile', username)
+
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+@staff_member_required
+def export_table(request, table):
+    if table not in export.EXPORTS:
+        raise Http404
+    file_format = request.GET.get('format', 'ndjson')
+    if file_format not in export.FORMATS:
+        return HttpResponseBadRequest('Неизвестный формат')
+    since = None
+    if request.GET.get('since'):
+        try:
+            since = export.parse_since(request.GET['since'])
+        except ValueError as error:
+            return HttpResponseBadRequest(str(error))
+    gzip = request.GET.get('gzip') == '1'
+    until = export.watermark()
+    response = StreamingHttpResponse(
+        export.export(table, file_format, since, until, gzip),
+        content_type=(
+            'application/gzip' if gzip
+            else EXPORT_CONTENT_TYPES[file_format]
+        )
+    )
+    file_name = export.file_name(table, file_format, gzip)
+    response['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    # since для следующей инкрементальной выгрузки.
+    response['X-Export-Watermark'] = until.isoformat()
+    return response
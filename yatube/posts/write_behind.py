@@ -0,0 +1,221 @@
+"""Отложенная запись комментариев и подписок пачками.
+
+add_comment, profile_follow и profile_unfollow не пишут в базу сами, а
+ставят операцию в очередь процесса. Поток-писатель забирает из неё
+всё, что накопилось, пока писалась прошлая пачка (не больше
+WRITE_BEHIND_BATCH_SIZE операций), и записывает это одной транзакцией
+через bulk_create. При всплеске комментариев на популярный пост замок
+записи SQLite и fsync берутся раз на пачку, а не раз на запрос.
+
+Запрос ждёт коммита своей пачки до WRITE_BEHIND_WAIT секунд, поэтому
+после редиректа автор сразу видит свой комментарий или подписку.
+Сигналы при bulk_create не срабатывают, и счётчики, ленты и теги кэша
+write_batch обновляет сам, так же как posts.signals.
+
+При WRITE_BEHIND_ENABLED = False операция пишется тем же write_batch
+прямо в потоке запроса.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent import futures
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from core import db_router
+from core.cache import bump_tags
+
+from . import cache_tags, counters, feed, follow_graph
+from .models import Comment, Follow
+
+logger = logging.getLogger(__name__)
+
+COMMENT = 'comment'
+FOLLOW = 'follow'
+UNFOLLOW = 'unfollow'
+
+# obj — несохранённый Comment или пара (user_id, author_id).
+Operation = namedtuple('Operation', 'kind obj future')
+
+
+def _write_follows(wanted):
+    """Приводит подписки к wanted {(user_id, author_id): подписан ли}.
+
+    Возвращает созданные пары; об удалённых позаботились сигналы.
+    """
+    if not wanted:
+        return []
+    user_ids, author_ids = map(set, zip(*wanted))
+    existing = {
+        (user_id, author_id): pk
+        for user_id, author_id, pk in Follow.objects.filter(
+            user_id__in=user_ids, author_id__in=author_ids
+        ).values_list('user_id', 'author_id', 'pk')
+        if (user_id, author_id) in wanted
+    }
+    created = [
+        pair for pair, following in wanted.items()
+        if following and pair not in existing
+    ]
+    removed = [
+        pair for pair, following in wanted.items()
+        if not following and pair in existing
+    ]
+    Follow.objects.bulk_create(
+        [Follow(user_id=user_id, author_id=author_id)
+         for user_id, author_id in created],
+        ignore_conflicts=True
+    )
+    # Удаление через QuerySet само вызывает сигналы отписки.
+    Follow.objects.filter(pk__in=[existing[pair] for pair in removed]).delete()
+    for user_id, count in Counter(user for user, _ in created).items():
+        counters.change_user_stats(user_id, following_count=count)
+    for author_id, count in Counter(author for _, author in created).items():
+        counters.change_user_stats(author_id, followers_count=count)
+    for user_id, author_id in created:
+        feed.backfill(user_id, author_id)
+    return created
+
+
+def write_batch(operations):
+    """Записывает операции одной транзакцией.
+
+    Из нескольких подписок и отписок одной пары в пачке побеждает
+    последняя. Исключение значит, что транзакция откатилась и ничего
+    не записано.
+    """
+    comments = [op.obj for op in operations if op.kind == COMMENT]
+    wanted = {
+        op.obj: op.kind == FOLLOW
+        for op in operations if op.kind != COMMENT
+    }
+    with transaction.atomic():
+        Comment.objects.bulk_create(comments)
+        post_ids = Counter(comment.post_id for comment in comments)
+        for post_id, count in post_ids.items():
+            counters.change_post_comments(post_id, count)
+        created = _write_follows(wanted)
+    tags = list(map(cache_tags.post_tag, post_ids))
+    for user_id, author_id in created:
+        tags.append(cache_tags.author_tag(author_id))
+        tags.append(cache_tags.author_tag(user_id))
+        tags.extend(follow_graph.follow_tags(user_id, author_id))
+    # Пачка уже в базе: ошибка кэша не должна привести к повторной
+    # записи в _write.
+    try:
+        bump_tags(*tags)
+    except Exception:
+        logger.exception('Не удалось сдвинуть теги после пачки')
+
+
+def _write(operations):
+    try:
+        write_batch(operations)
+    except Exception as error:
+        if len(operations) > 1:
+            # Пачка откатилась целиком; пишем по одной, чтобы плохая
+            # операция (пост успели удалить) не потянула за собой
+            # остальные.
+            for operation in operations:
+                _write([operation])
+            return
+        operations[0].future.set_exception(error)
+        return
+    for operation in operations:
+        operation.future.set_result(operation.obj)
+
+
+class WriteQueue:
+    """Очередь операций процесса и поток, который пишет их пачками."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pid = None
+        self._thread = None
+
+    def submit(self, kind, obj):
+        operation = Operation(kind, obj, futures.Future())
+        # Запись сделает другой поток, а читать с default после неё
+        # должен этот запрос и следующие запросы клиента.
+        db_router.pin_to_primary()
+        if not settings.WRITE_BEHIND_ENABLED:
+            _write([operation])
+        else:
+            self._start()
+            self._queue.put(operation)
+        return operation.future
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Очередь и поток родителя после fork не работают.
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='write-behind', daemon=True
+            )
+            self._thread.start()
+
+    def _next_batch(self):
+        """Первая операция очереди и всё, что успело прийти за ней."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + settings.WRITE_BEHIND_MAX_DELAY
+        while len(batch) < settings.WRITE_BEHIND_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            close_old_connections()
+            try:
+                _write(batch)
+            except Exception:
+                logger.exception('Пачка отложенной записи упала')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Ждёт, пока очередь процесса запишется целиком."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+
+write_queue = WriteQueue()
+
+
+def _wait(future):
+    try:
+        return future.result(settings.WRITE_BEHIND_WAIT)
+    except futures.TimeoutError:
+        # Запись ещё в очереди и дойдёт до базы чуть позже.
+        logger.warning('Отложенная запись не успела за %s с',
+                       settings.WRITE_BEHIND_WAIT)
+        return None
+
+
+def save_comment(comment):
+    return _wait(write_queue.submit(COMMENT, comment))
+
+
+def follow(user, author):
+    return _wait(write_queue.submit(FOLLOW, (user.pk, author.pk)))
+
+
+def unfollow(user, author):
+    return _wait(write_queue.submit(UNFOLLOW, (user.pk, author.pk)))
@@ -47,7 +47,22 @@ INSTALLED_APPS = [
     'sorl.thumbnail'
 ]
 
+# Сессии и пользователь запроса берутся из кэша (core.sessions,
+# core.auth), а в базу идут только при промахе и изменениях.
+# ModelBackend остаётся для сессий, созданных до CachedModelBackend.
+SESSION_ENGINE = 'core.sessions'
+# Изменённая сессия пишется в базу не чаще раза в столько секунд.
+SESSION_DB_SAVE_INTERVAL = 5 * 60
+AUTHENTICATION_BACKENDS = [
+    'core.auth.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+USER_CACHE_TIMEOUT = 5 * 60
+
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.NPlusOneMiddleware',
+    'core.middleware.ReplicaPinMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,7 +77,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backends.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -76,6 +91,18 @@ TEMPLATES = [
         },
     },
 ]
+# Вне DEBUG шаблоны компилируются один раз на процесс кэширующим
+# загрузчиком и разбираются заранее, при старте
+# (core.template_backends.warm_up).
+TEMPLATE_CACHE = not DEBUG
+if TEMPLATE_CACHE:
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
@@ -86,9 +113,39 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'CONN_MAX_AGE': 60,
+    },
+    # Локальная заглушка реплики для тестов роутера; в бою здесь
+    # описываются настоящие реплики.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db_replica.sqlite3'),
+        },
+    },
 }
 
+# Прагмы каждого нового соединения с SQLite (core.sqlite). Пустой
+# словарь оставляет настройки SQLite по умолчанию.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
+}
+
+# Чтения внутри запросов уходят на реплики из DATABASE_REPLICAS, а
+# клиент, который только что писал, REPLICA_PIN_SECONDS секунд читает
+# с default (core.db_router).
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_PIN_COOKIE = 'pin_primary'
+REPLICA_PIN_SECONDS = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -139,14 +196,95 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 POSTS_PER_PAGE = 10
+PAGINATOR_WINDOW = 5
+PAGINATOR_COUNT_TIMEOUT = 60
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Страницы лент инвалидируются тегами (core.cache), поэтому могут жить
+# в кэше долго.
+PAGE_CACHE_TIMEOUT = 60 * 60
+# Пока одна вьюха пересчитывает страницу, остальные ещё столько секунд
+# после TIMEOUT отдают старую копию, а при пустом кэше ждут пересчёта
+# не дольше COALESCE_WAIT. EARLY_BETA > 1 начинает пересчёт раньше.
+PAGE_CACHE_STALE_SECONDS = 5 * 60
+PAGE_CACHE_LOCK_TIMEOUT = 30
+PAGE_CACHE_COALESCE_WAIT = 2.0
+PAGE_CACHE_EARLY_BETA = 1.0
+# Отрисованные карточки постов (posts.templatetags.post_cards) меняют
+# ключ при правке поста, автора или группы.
+POST_CARD_TIMEOUT = 24 * 60 * 60
+
+# Один кэш на все процессы машины (core.cache_backends): страницы,
+# поколения тегов, сессии и карточки видны всем воркерам сразу.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache_backends.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'MAX_SIZE': 256 * 2 ** 20,
+        },
     }
 }
+# Тесты получают свой файл кэша во временном каталоге.
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# Лента подписок раскладывается по читателям при публикации. Посты
+# авторов, у которых постов не меньше FEED_PULL_AUTHOR_POSTS,
+# подмешиваются при чтении ленты.
+FEED_PULL_AUTHOR_POSTS = 1000
+FEED_PULL_AUTHORS_TIMEOUT = 5 * 60
+FEED_BATCH_SIZE = 500
+
+# Миниатюры картинок постов режутся в фоне (posts.thumbnails), шаблоны
+# берут только готовые. Пресет: (геометрия, опции sorl-thumbnail).
+THUMBNAIL_PRESETS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+# Сколько потоков в процессе веб-сервера разбирают очередь сразу после
+# сохранения поста; при 0 очередь разбирает только thumbnail_worker.
+THUMBNAIL_WORKER_THREADS = 0
+THUMBNAIL_JOB_MAX_ATTEMPTS = 3
+THUMBNAIL_JOB_TIMEOUT = 5 * 60
+
+# Та же очередь готовит для картинки поста варианты разной ширины в
+# JPEG и WebP, а шаблоны отдают их через srcset.
+POST_IMAGE_WIDTHS = (320, 640, 960)
+POST_IMAGE_FORMATS = ('WEBP', 'JPEG')
+POST_IMAGE_QUALITY = 80
+POST_IMAGE_SIZES = '(min-width: 768px) 720px, 100vw'
+
+# Метрики запросов по вьюхам (core.metrics) отдаются Prometheus на
+# /metrics/ только с заголовком Authorization: Bearer <METRICS_TOKEN>.
+# Пока токен пуст, страница метрик выключена.
+METRICS_ENABLED = True
+METRICS_TOKEN = ''
+METRICS_TIME_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+METRICS_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+METRICS_SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Поиск N+1 (core.queries): запрос, повторённый за один запрос к сайту
+# больше NPLUSONE_THRESHOLD раз, попадает в лог или роняет запрос.
+NPLUSONE_ENABLED = DEBUG
+NPLUSONE_RAISE = False
+NPLUSONE_THRESHOLD = 3
+
+# Комментарии и подписки пишутся пачками из очереди процесса
+# (posts.write_behind). Запрос ждёт коммита своей пачки не дольше
+# WRITE_BEHIND_WAIT секунд; WRITE_BEHIND_MAX_DELAY — сколько писатель
+# дожидается попутчиков для пачки.
+WRITE_BEHIND_ENABLED = not DEBUG
+WRITE_BEHIND_BATCH_SIZE = 200
+WRITE_BEHIND_MAX_DELAY = 0
+WRITE_BEHIND_WAIT = 5.0
+
+# Списки подписок и подписчиков (posts.follow_graph) лежат в кэше под
+# поколениями своих тегов; по ним же считаются рекомендации авторов.
+FOLLOW_GRAPH_TIMEOUT = 24 * 60 * 60
+FOLLOW_SUGGESTIONS = 5
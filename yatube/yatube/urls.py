@@ -20,6 +20,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from core.views import metrics_view
+
 urlpatterns = [
     path('', include('posts.urls', namespace='posts')),
     path(
@@ -43,6 +45,7 @@ urlpatterns = [
         include('posts.urls', namespace='posts')
     ),
     path('create/', include('posts.urls', namespace='posts')),
+    path('metrics/', metrics_view, name='metrics'),
 
 ]
 